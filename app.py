@@ -1,101 +1,240 @@
-from flask import Flask, request, render_template, redirect, url_for, send_from_directory
-from werkzeug.utils import secure_filename
+from flask import Flask, request, render_template, redirect, url_for, send_from_directory, abort, make_response, Response, stream_with_context
+from werkzeug.utils import secure_filename, safe_join
 import os
 import json
+import gzip
+import zlib
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
 import sqlite3
 from datetime import datetime
 import mapping
 import re
 import boto3
-import yaml
 import waf_analyzer
+import snapshot
+import rule_order
+import aws_import
+import fleet
+import log_analytics
+import iac_ingest
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used when it isn't installed
+    brotli = None
 
 UPLOAD_FOLDER = 'uploads'
+SNAPSHOT_FOLDER = os.path.join(UPLOAD_FOLDER, 'snapshots')
+TRAFFIC_FOLDER = os.path.join(UPLOAD_FOLDER, 'traffic')
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-ipset_refs = {}  # { arn: {name: name, rules: [list of rules using it] }}
-regexpattern_refs = {} 
+snapshots = {}  # { file_id: snapshot.Snapshot } mapped once per worker
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+response_cache = OrderedDict()  # { (etag, encoding): (body, mimetype) }, least recently used first
+response_cache_size = 0
+response_cache_lock = threading.Lock()
+STREAM_MAX_BATCH = 256  # records per chunk of a streamed graph
+WCU_SESSIONS_MAX = 1000
+wcu_sessions = OrderedDict()  # { doc_id: (revision, per-rule results) } for live WCU deltas
+wcu_sessions_lock = threading.Lock()
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-def sanitize_for_json(obj):
-    if isinstance(obj, bytes):
-        return obj.decode('utf-8')  # decode bytes to string
-    if isinstance(obj, dict):
-        return {k: sanitize_for_json(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [sanitize_for_json(i) for i in obj]
-    return obj
-
-def collect_references(statement, rule_name, webacl_name):
-    if not isinstance(statement, dict):
-        return
-
-    if "IPSetReferenceStatement" in statement:
-        arn = statement["IPSetReferenceStatement"]["ARN"]
-        # Extract name from ARN
-        parts = arn.split('/')
-        ipset_name = parts[-2] if len(parts) >= 2 else arn
-
-        if arn not in ipset_refs:
-            ipset_refs[arn] = {"name": ipset_name, "rules": []}
-        ipset_refs[arn]["rules"].append({"web_acl": webacl_name, "rule_name": rule_name})
-
-    if "RegexPatternSetReferenceStatement" in statement:
-        arn = statement["RegexPatternSetReferenceStatement"]["ARN"]
-        # Extract name from ARN
-        parts = arn.split('/')
-        regex_name = parts[-2] if len(parts) >= 2 else arn
-
-        if arn not in regexpattern_refs:
-            regexpattern_refs[arn] = {"name": regex_name, "rules": []}
-        regexpattern_refs[arn]["rules"].append({"web_acl": webacl_name, "rule_name": rule_name})
-
-    # Recurse deeper into nested statements
-    for value in statement.values():
-        if isinstance(value, dict):
-            collect_references(value, rule_name, webacl_name)
-        elif isinstance(value, list):
-            for item in value:
-                if isinstance(item, dict):
-                    collect_references(item, rule_name, webacl_name)
-
-def save_refs():
-    with open(os.path.join(UPLOAD_FOLDER, "ipset_refs.json"), "w") as f:
-        json.dump(ipset_refs, f)
-    with open(os.path.join(UPLOAD_FOLDER, "regexpattern_refs.json"), "w") as f:
-        json.dump(regexpattern_refs, f)
-
-def load_refs():
-    global ipset_refs, regexpattern_refs
-    ipset_path = os.path.join(UPLOAD_FOLDER, "ipset_refs.json")
-    regex_path = os.path.join(UPLOAD_FOLDER, "regexpattern_refs.json")
-    if os.path.isfile(ipset_path):
-        with open(ipset_path) as f:
-            ipset_refs = json.load(f)
-    if os.path.isfile(regex_path):
-        with open(regex_path) as f:
-            regexpattern_refs = json.load(f)
+def upload_path(file_id):
+    # file_id may be namespaced (<account>/<region>/<scope>/<file>) but must stay inside UPLOAD_FOLDER
+    path = safe_join(UPLOAD_FOLDER, file_id)
+    if path is None:
+        abort(404)
+    return path
+
+def list_upload_files():
+    files = []
+    for root, dirs, names in os.walk(UPLOAD_FOLDER):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) not in (SNAPSHOT_FOLDER, TRAFFIC_FOLDER))
+        for name in sorted(names):
+            if name.endswith(".json") and name not in aws_import.REF_FILES.values():
+                files.append(os.path.relpath(os.path.join(root, name), UPLOAD_FOLDER).replace(os.sep, "/"))
+    return files
+
+def ingest_snapshot(file_id, rule_groups=None):
+    source = upload_path(file_id)
+    if rule_groups is None:
+        rule_groups = snapshot.load_rule_groups(os.path.dirname(source))
+    snapshot.ingest(source, snapshot.snapshot_path(SNAPSHOT_FOLDER, file_id), rule_groups)
+
+def load_snapshot(file_id):
+    source = upload_path(file_id)
+    if not os.path.isfile(source):
+        abort(404)
+    # Rule groups are looked up next to the WebACL, i.e. in the same account/region/scope
+    rule_groups = snapshot.load_rule_groups(os.path.dirname(source))
+    snap = snapshots.get(file_id)
+    if snap is None or snap.is_stale(source, rule_groups):
+        path = snapshot.snapshot_path(SNAPSHOT_FOLDER, file_id)
+        try:
+            fresh = snapshot.Snapshot(path)
+        except (FileNotFoundError, snapshot.SnapshotError):
+            fresh = None
+        if fresh is None or fresh.is_stale(source, rule_groups):
+            if fresh is not None:
+                fresh.close()
+            ingest_snapshot(file_id, rule_groups)
+            fresh = snapshot.Snapshot(path)
+        # The old mapping is left for the GC; a concurrent request may still be reading it
+        snap = snapshots[file_id] = fresh
+    return snap
+
+def cache_get(key):
+    with response_cache_lock:
+        entry = response_cache.get(key)
+        if entry is not None:
+            response_cache.move_to_end(key)
+        return entry
+
+def cache_put(key, entry):
+    global response_cache_size
+    with response_cache_lock:
+        if key in response_cache:
+            return
+        response_cache[key] = entry
+        response_cache_size += len(entry[0])
+        while response_cache_size > RESPONSE_CACHE_MAX_BYTES and len(response_cache) > 1:
+            _, (body, _) = response_cache.popitem(last=False)
+            response_cache_size -= len(body)
+
+def negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def encode_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+def view_etag(snap):
+    # Identifies a response that depends only on the WebACL snapshot, its analyzed traffic and the URL
+    traffic = log_analytics.stamp(TRAFFIC_FOLDER, snap.meta().get("ARN"))
+    return hashlib.sha1(f"{request.full_path}|{snap.digest}|{traffic}".encode()).hexdigest()
+
+def traffic_hits(snap):
+    # Hit counts from analyzed WAF logs, optionally limited to ?from=&to=; None when there are no logs
+    traffic = log_analytics.load_traffic(TRAFFIC_FOLDER, snap.meta().get("ARN"))
+    if traffic is None:
+        return None
+    try:
+        start = log_analytics.parse_time(request.args.get("from"))
+        end = log_analytics.parse_time(request.args.get("to"))
+    except ValueError:
+        abort(400, "Invalid from/to: use epoch seconds or ISO 8601")
+    return log_analytics.hit_counts(traffic, start, end)
+
+def ndjson_chunks(records):
+    # The first record goes out on its own so the viewer can draw at once; later chunks grow up to
+    # STREAM_MAX_BATCH records to keep the number of writes down
+    batch, size = [], 1
+    for record in records:
+        batch.append(json.dumps(record))
+        if len(batch) >= size:
+            yield "\n".join(batch) + "\n"
+            batch, size = [], min(size * 2, STREAM_MAX_BATCH)
+    if batch:
+        yield "\n".join(batch) + "\n"
+
+def iter_json(value):
+    # json.dumps output in pieces, with an explicit stack so any nesting depth can be encoded
+    stack = [(iter((value,)), False, "")]
+    first = [True]
+    while stack:
+        items, is_dict, closer = stack[-1]
+        item = next(items, stack)
+        if item is stack:
+            stack.pop()
+            first.pop()
+            yield closer
+            continue
+        if not first[-1]:
+            yield ", "
+        first[-1] = False
+        if is_dict:
+            key, item = item
+            yield json.dumps(str(key)) + ": "
+        if isinstance(item, dict):
+            yield "{"
+            stack.append((iter(item.items()), True, "}"))
+            first.append(True)
+        elif isinstance(item, (list, tuple)):
+            yield "["
+            stack.append((iter(item), False, "]"))
+            first.append(True)
+        else:
+            yield json.dumps(item)
+
+def gzip_chunks(chunks):
+    # One gzip stream, flushed after every chunk (Z_SYNC_FLUSH) so the client can decode each as it arrives
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+def cached_view(view):
+    # Views that depend only on the WebACL snapshot, its analyzed traffic and the URL:
+    # ETag, 304 and a rendered-response cache
+    @functools.wraps(view)
+    def wrapper(file_id, **kwargs):
+        snap = load_snapshot(file_id)
+        etag = view_etag(snap)
+        encoding = negotiate_encoding()
+        variant = f"{etag}-{encoding}" if encoding else etag
+
+        if request.if_none_match.contains_weak(variant):
+            response = Response(status=304)
+        else:
+            entry = cache_get((etag, encoding))
+            if entry is None:
+                identity = cache_get((etag, None))
+                if identity is None:
+                    rendered = make_response(view(file_id, **kwargs))
+                    if rendered.status_code != 200:
+                        return rendered
+                    identity = (rendered.get_data(), rendered.mimetype)
+                    cache_put((etag, None), identity)
+                entry = (encode_body(identity[0], encoding), identity[1])
+                cache_put((etag, encoding), entry)
+            response = Response(entry[0], mimetype=entry[1])
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+
+        response.set_etag(variant)
+        response.headers["Vary"] = "Accept-Encoding"
+        # Let browsers keep the page but revalidate it on every load
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    return wrapper
             
 # Home route - list uploaded files
 @app.route('/')
 def index():
-    files = [
-        f for f in os.listdir(UPLOAD_FOLDER)
-        if os.path.isfile(os.path.join(UPLOAD_FOLDER, f))
-        and not (f.startswith("ipset_refs") or f.startswith("regexpattern_refs"))
-    ]
-    return render_template("index.html", files=files)
-
-@app.route('/api/<file_id>/<rule_name>')
+    return render_template("index.html", files=list_upload_files())
+
+@app.route('/api/<path:file_id>/<rule_name>')
+@cached_view
 def get_files(file_id,rule_name):
-    with open(f"{UPLOAD_FOLDER}/{file_id}") as f:
-        data = json.load(f)
-    rules = data.get("Rules", [])
-    producers, consumers = mapping.find_label_relationships(rules)
-    result = mapping.build_relationship(rule_name, rules, producers, consumers)
-    return json.dumps(result)
+    snap = load_snapshot(file_id)
+    result = mapping.build_relationship(
+        rule_name, snap.rules, snap.producers, snap.consumers, priorities=snap.priorities()
+    )
+    # A long label chain nests deeper than json.dumps can recurse
+    return "".join(iter_json(result))
 
 # Upload endpoint
 @app.route('/upload', methods=['POST'])
@@ -105,57 +244,115 @@ def upload():
     file = request.files['file']
     if file.filename == '':
         return "No selected file", 400
+    filename = secure_filename(file.filename)
+    data = file.read()
+
+    # Terraform and CloudFormation templates are converted to WebACL / RuleGroup JSON
+    kind = iac_ingest.source_kind(filename)
+    if kind in ("tf", "tf.json") or (kind == "cfn" and (not filename.endswith(".json") or b"AWS::WAFv2::" in data)):
+        try:
+            iac_ingest.ingest_file(filename, data, UPLOAD_FOLDER, SNAPSHOT_FOLDER, UPLOAD_FOLDER)
+        except Exception as e:
+            return f"Could not import {filename}: {e}", 400
+        return redirect(url_for('index'))
+
     if '.json' not in file.filename:
         return "Invalid file type", 400
-    filename = secure_filename(file.filename)
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
+    with open(filepath, "wb") as f:
+        f.write(data)
+    ingest_snapshot(filename)
 
     return redirect(url_for('index'))
 
 #view rules list
-@app.route('/viewRules/<file_id>')
+@app.route('/viewRules/<path:file_id>')
+@cached_view
 def process(file_id):
-    with open(f"{UPLOAD_FOLDER}/{file_id}") as f:
-        data = json.load(f)
-    rules = data.get("Rules", [])
-    return render_template("view_rules.html", rules=rules, file_id=file_id)  
+    analysis = rule_order.analyze_rule_order(load_snapshot(file_id).rule_list())
+    return render_template("view_rules.html", rules=analysis["rules"], analysis=analysis, file_id=file_id)  
 
-# View mermaid graph
-@app.route("/view/<file_id>/<rule_name>")
+# View mermaid graph; the graph itself is streamed from /stream
+@app.route("/view/<path:file_id>/<rule_name>")
+@cached_view
 def view(file_id, rule_name):
-    with open(f"{UPLOAD_FOLDER}/{file_id}") as f:
-        data = json.load(f)
-    rules = data.get("Rules", [])
-    producers, consumers = mapping.find_label_relationships(rules)
-    result = mapping.build_relationship(rule_name, rules, producers, consumers)
-    graph = mapping.generate_mermaid_from_relationship(result, rule_name)
+    snap = load_snapshot(file_id)
     #get the rule statement
-    for rule in rules:
-        if rule["Name"] == rule_name:
-            rule_statement = rule["Statement"]
-            break
-    return render_template("viewer.html", graph=graph, rule_name=rule_name, rule_statement=rule_statement)
+    rule_statement = (snap.rules.get(rule_name) or {}).get("Statement")
+    return render_template(
+        "viewer.html",
+        stream_url=url_for("stream_graph", file_id=file_id, rule_name=rule_name),
+        rule_name=rule_name,
+        rule_statement=rule_statement,
+    )
 
-@app.route("/view-vis/<file_id>/<rule_name>")
+@app.route("/view-vis/<path:file_id>/<rule_name>")
+@cached_view
 def view_vis(file_id, rule_name):
-    with open(f"{UPLOAD_FOLDER}/{file_id}") as f:
-        data = json.load(f)
-    rules = data.get("Rules", [])
-    producers, consumers = mapping.find_label_relationships(rules)
-    result = mapping.build_relationship(rule_name, rules, producers, consumers)
-    #clean_map = mapping.clean_node(result)
-    graph = mapping.generate_mermaid_from_relationship(result, rule_name)
-    vis_data = mapping.mermaid_to_vis(graph)
+    snap = load_snapshot(file_id)
     # Get the rule statement
-    rule_statement = next((rule["Statement"] for rule in rules if rule["Name"] == rule_name), None)
+    rule_statement = (snap.rules.get(rule_name) or {}).get("Statement")
     return render_template(
         "viewer_vis.html",
-        nodes=vis_data["nodes"],
-        edges=vis_data["edges"],
+        stream_url=url_for("stream_graph", file_id=file_id, rule_name=rule_name, **request.args),
         rule_name=rule_name,
         rule_statement=rule_statement,
+        hits=traffic_hits(snap),
     )
+
+# Rule graph as NDJSON, written while the graph is walked:
+#   {"node": {"id", "label"[, "title"]}} the first time a node is seen
+#   {"edge": {"from", "to", "label"[, "hits"]}} with hit counts when WAF logs were analyzed
+#   {"done": edge count} last
+@app.route("/stream/<path:file_id>/<rule_name>")
+def stream_graph(file_id, rule_name):
+    snap = load_snapshot(file_id)
+    etag = view_etag(snap)
+    # Streamed responses are gzipped chunk by chunk; brotli would have to buffer
+    encoding = "gzip" if request.accept_encodings["gzip"] else None
+    variant = f"{etag}-{encoding}" if encoding else etag
+    if request.if_none_match.contains_weak(variant):
+        response = Response(status=304)
+        response.set_etag(variant)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+    hits = traffic_hits(snap)
+
+    def records():
+        names = {}
+        count = 0
+        edges = mapping.iter_relationship_edges(
+            rule_name, snap.rules, snap.producers, snap.consumers, priorities=snap.priorities()
+        )
+        for record in mapping.iter_vis_records(edges):
+            if hits is not None and "node" in record:
+                node = record["node"]
+                names[node["id"]] = node["label"]
+                title = log_analytics.node_title(node["label"], hits, snap.rules)
+                if title:
+                    node["title"] = title
+            elif "edge" in record:
+                count += 1
+                edge = record["edge"]
+                if hits is not None:
+                    edge["hits"] = log_analytics.edge_hits(
+                        names[edge["from"]], edge["label"], names[edge["to"]], hits, snap.rules
+                    )
+            yield record
+        yield {"done": count}
+
+    chunks = ndjson_chunks(records())
+    if encoding:
+        chunks = gzip_chunks(chunks)
+    response = Response(stream_with_context(chunks), mimetype="application/x-ndjson")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.set_etag(variant)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    # Keep reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
     
 #load from AWS
 @app.route('/load_aws', methods=['POST'])
@@ -168,12 +365,7 @@ def load_aws():
     if not (access_key and secret_key and region):
         return "Missing required AWS credentials", 400
 
-    if region == 'global':
-        boto_region = 'us-east-1'  # CloudFront always uses us-east-1
-        scope = 'CLOUDFRONT'
-    else:
-        boto_region = region
-        scope = 'REGIONAL'
+    boto_region, scope = aws_import.scope_for_region(region)
 
     session_params = {
         'aws_access_key_id': access_key,
@@ -186,77 +378,47 @@ def load_aws():
     try:
         session = boto3.Session(**session_params)
         waf = session.client('wafv2')
-
-        # Fetch and save WebACLs
-        response = waf.list_web_acls(Scope=scope)
-        webacls = response.get('WebACLs', [])
-
-        for acl in webacls:
-            acl_name = acl['Name']
-            acl_id = acl['Id']
-
-            acl_details = waf.get_web_acl(
-                Name=acl_name,
-                Scope=scope,
-                Id=acl_id
-            )
-
-            # Save WebACL as separate file
-            acl_filename = f"WebACL_{acl_name}.json"
-            acl_filepath = os.path.join(UPLOAD_FOLDER, acl_filename)
-            with open(acl_filepath, "w") as f:
-                json.dump(sanitize_for_json(acl_details['WebACL']), f, indent=2)
-
-            # Save referenced IP sets
-            for rule in acl_details['WebACL'].get('Rules', []):
-                rule_name = rule.get('Name')
-                statement = rule.get('Statement')
-                collect_references(statement, rule_name, acl_name)
-            
-        # Save referenced IP sets
-        for arn, ref_info in ipset_refs.items():
-            parts = arn.split('/')
-            ipset_name = ref_info['name']
-            ipset_id = parts[-1]
-
-            ipset = waf.get_ip_set(
-                Name=ipset_name,
-                Scope=scope,
-                Id=ipset_id
-            )
-            
-            # Save the IPSet JSON
-            ipset_filename = f"IPSet_{ipset_name}.json"
-            ipset_filepath = os.path.join(UPLOAD_FOLDER, ipset_filename)
-            with open(ipset_filepath, "w") as f:
-                json.dump(sanitize_for_json(ipset['IPSet']), f, indent=2)
-
-        # Save referenced RegexPatternSets
-        for arn, ref_info in regexpattern_refs.items():
-            parts = arn.split('/')
-            regex_name = ref_info['name']
-            regex_id = parts[-1]
-
-            regexset = waf.get_regex_pattern_set(
-                Name=regex_name,
-                Scope=scope,
-                Id=regex_id
-            )
-            
-            # Save the RegexPatternSet JSON
-            regex_filename = f"RegexPatternSet_{regex_name}.json"
-            regex_filepath = os.path.join(UPLOAD_FOLDER, regex_filename)
-            with open(regex_filepath, "w") as f:
-                json.dump(sanitize_for_json(regexset['RegexPatternSet']), f, indent=2)
-        # Save references to files
-        save_refs()
+        aws_import.import_web_acls(waf, scope, UPLOAD_FOLDER, SNAPSHOT_FOLDER)
         return redirect(url_for('index'))
     except Exception as e:
         return f"Error connecting to AWS: {str(e)}", 500
 
-@app.route('/view-ipset/<filename>')
+#load from many accounts / regions at once
+@app.route('/load_aws_fleet', methods=['POST'])
+def load_aws_fleet():
+    role_arns = [r.strip() for r in request.form.get('role_arns', '').splitlines() if r.strip()]
+    regions = request.form.getlist('regions')
+    if not (role_arns and regions):
+        return "Missing role ARNs or regions", 400
+    invalid = fleet.invalid_role_arns(role_arns)
+    if invalid:
+        return "Invalid role ARNs (expected arn:aws:iam::<12-digit account>:role/<name>):\n" + "\n".join(invalid), 400, {'Content-Type': 'text/plain'}
+
+    # Roles are assumed from the given keys, or from the app's own credentials if none are given
+    session_params = {}
+    if request.form.get('access_key') and request.form.get('secret_key'):
+        session_params = {
+            'aws_access_key_id': request.form.get('access_key'),
+            'aws_secret_access_key': request.form.get('secret_key'),
+        }
+        if request.form.get('session_token'):
+            session_params['aws_session_token'] = request.form.get('session_token')
+
+    imported, errors = fleet.import_fleet(
+        role_arns,
+        regions,
+        UPLOAD_FOLDER,
+        SNAPSHOT_FOLDER,
+        base_session=boto3.Session(**session_params),
+    )
+    if errors:
+        failed = "\n".join(f"{role_arn} {region}: {error}" for (role_arn, region), error in sorted(errors.items()))
+        return f"Imported {len(imported)} account/region pairs, {len(errors)} failed:\n{failed}", 207, {'Content-Type': 'text/plain'}
+    return redirect(url_for('index'))
+
+@app.route('/view-ipset/<path:filename>')
 def view_ipset(filename):
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    filepath = upload_path(filename)
     if not os.path.isfile(filepath):
         return "IPSet file not found", 404
 
@@ -265,13 +427,13 @@ def view_ipset(filename):
         ipset_content = json.load(f)
         
     #load refs
-    load_refs()
+    refs = aws_import.load_refs(os.path.dirname(filepath))
 
     # Extract arn from file content
     arn = ipset_content.get("ARN", "")
     
     # Find related rules
-    rules = ipset_refs[arn]["rules"]
+    rules = refs["ipset"].get(arn, {}).get("rules", [])
     
     return render_template(
         'view_ipset.html',
@@ -281,14 +443,14 @@ def view_ipset(filename):
         active_page="mapper"
     )
 
-@app.route('/view-regex/<filename>')
+@app.route('/view-regex/<path:filename>')
 def view_regex(filename):
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    filepath = upload_path(filename)
     if not os.path.isfile(filepath):
         return "RegexPatternSet file not found", 404
 
     #load refs
-    load_refs()
+    refs = aws_import.load_refs(os.path.dirname(filepath))
 
     # Load RegexPatternSet content
     with open(filepath) as f:
@@ -298,7 +460,7 @@ def view_regex(filename):
     arn = regex_content.get("ARN", "")
 
     # Find related rules
-    rules = regexpattern_refs[arn].get('rules', [])
+    rules = refs["regex"].get(arn, {}).get('rules', [])
 
     return render_template(
         'view_regex.html',
@@ -324,10 +486,7 @@ def wcu_analyzer():
 
         try:
             # Parse input
-            if format_selected == "yaml":
-                parsed_data = yaml.safe_load(user_input)
-            else:
-                parsed_data = json.loads(user_input)
+            parsed_data = waf_analyzer.parse_document(user_input, format_selected)
 
             # Placeholder: perform static analysis (to be implemented)
             static_result = waf_analyzer.calculate_wcu_static(parsed_data)
@@ -347,5 +506,49 @@ def wcu_analyzer():
         active_page="wcu"
     )
 
+@app.route('/api/wcu', methods=['POST'])
+def wcu_live():
+    # Incremental WCU for the editor: only rules whose statement changed are re-costed, and the
+    # response carries per-rule deltas against the revision the client says it already has
+    payload = request.get_json(silent=True) or {}
+    doc_id = str(payload.get("doc_id", ""))
+    revision = payload.get("revision")
+    base_revision = payload.get("base_revision")
+
+    try:
+        parsed_data = waf_analyzer.parse_document(payload.get("document", ""), payload.get("format", "json"))
+        results, recomputed = waf_analyzer.analyze_rules(waf_analyzer.extract_rules(parsed_data))
+    except Exception as e:
+        return json.dumps({"revision": revision, "error": str(e)}), 400, {'Content-Type': 'application/json'}
+
+    with wcu_sessions_lock:
+        previous = wcu_sessions.pop(doc_id, None)
+        wcu_sessions[doc_id] = (revision, results)
+        if len(wcu_sessions) > WCU_SESSIONS_MAX:
+            wcu_sessions.popitem(last=False)
+
+    full = previous is None or base_revision is None or previous[0] != base_revision
+    before = {} if full else previous[1]
+    changed = []
+    for key, result in results.items():
+        old = before.get(key)
+        if full or old is None or old["wcu"] != result["wcu"] or old["detail"] != result["detail"]:
+            changed.append(dict(result, key=key, delta=result["wcu"] - (old["wcu"] if old else 0)))
+    removed = [key for key in before if key not in results]
+
+    total = sum(r["wcu"] for r in results.values())
+    return json.dumps({
+        "revision": revision,
+        "base_revision": None if full else base_revision,
+        "full": full,
+        "total": total,
+        "delta_total": total - sum(r["wcu"] for r in before.values()),
+        # The rule order only needs resending when it changed
+        "order": list(results) if full or list(before) != list(results) else None,
+        "changed": changed,
+        "removed": removed,
+        "recomputed": recomputed,
+    }), 200, {'Content-Type': 'application/json'}
+
 if __name__ == '__main__':
     app.run(debug=True,host="0.0.0.0",port=5001)
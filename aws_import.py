@@ -0,0 +1,192 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import snapshot
+
+RULE_GROUP_FETCH_WORKERS = 8
+
+# Reference kind -> file the references are saved to, next to the imported WebACLs
+REF_FILES = {
+    "ipset": "ipset_refs.json",
+    "regex": "regexpattern_refs.json",
+    "rulegroup": "rulegroup_refs.json",
+}
+REF_STATEMENTS = {
+    "IPSetReferenceStatement": "ipset",
+    "RegexPatternSetReferenceStatement": "regex",
+    "RuleGroupReferenceStatement": "rulegroup",
+}
+# References from rules inside rule groups are recorded under "rulegroup:<group name>" instead of a WebACL name
+RULE_GROUP_OWNER = "rulegroup:"
+
+
+def sanitize_for_json(obj):
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')  # decode bytes to string
+    if isinstance(obj, dict):
+        return {k: sanitize_for_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [sanitize_for_json(i) for i in obj]
+    return obj
+
+
+def scope_for_region(region):
+    if region == 'global':
+        return 'us-east-1', 'CLOUDFRONT'  # CloudFront always uses us-east-1
+    return region, 'REGIONAL'
+
+
+def collect_references(statement, rule_name, webacl_name, refs):
+    # refs: { kind: { arn: {name: name, rules: [list of rules using it] } } }
+    if not isinstance(statement, dict):
+        return
+
+    for key, kind in REF_STATEMENTS.items():
+        if key in statement:
+            arn = statement[key]["ARN"]
+            # Extract name from ARN
+            parts = arn.split('/')
+            name = parts[-2] if len(parts) >= 2 else arn
+
+            refs[kind].setdefault(arn, {"name": name, "rules": []})
+            refs[kind][arn]["rules"].append({"web_acl": webacl_name, "rule_name": rule_name})
+
+    # Recurse deeper into nested statements
+    for value in statement.values():
+        if isinstance(value, dict):
+            collect_references(value, rule_name, webacl_name, refs)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    collect_references(item, rule_name, webacl_name, refs)
+
+
+def forget_web_acl(refs, webacl_name):
+    # Drop a WebACL's previous references before it is re-imported
+    for by_arn in refs.values():
+        for ref in by_arn.values():
+            ref["rules"] = [r for r in ref["rules"] if r["web_acl"] != webacl_name]
+
+
+def save_refs(folder, refs):
+    for kind, filename in REF_FILES.items():
+        with open(os.path.join(folder, filename), "w") as f:
+            json.dump(refs[kind], f)
+
+
+def load_refs(folder):
+    refs = {kind: {} for kind in REF_FILES}
+    for kind, filename in REF_FILES.items():
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path):
+            with open(path) as f:
+                refs[kind] = json.load(f)
+    return refs
+
+
+def list_rule_group_tokens(waf, scope):
+    # { arn: LockToken } for the account's own rule groups (one paginated call instead of a get per group)
+    tokens = {}
+    params = {'Scope': scope, 'Limit': 100}
+    while True:
+        response = waf.list_rule_groups(**params)
+        for group in response.get('RuleGroups', []):
+            tokens[group['ARN']] = group['LockToken']
+        marker = response.get('NextMarker')
+        if not marker:
+            return tokens
+        params['NextMarker'] = marker
+
+
+def fetch_rule_groups(waf, scope, arns, folder):
+    # Fetch each referenced rule group once, in parallel, skipping groups whose LockToken is unchanged
+    cached = snapshot.load_rule_groups(folder)
+    tokens = list_rule_group_tokens(waf, scope)
+    stale = [
+        arn for arn in arns
+        if arn not in cached or arn not in tokens or cached[arn].get('LockToken') != tokens[arn]
+    ]
+
+    def fetch(arn):
+        response = waf.get_rule_group(ARN=arn)
+        group = sanitize_for_json(response['RuleGroup'])
+        group['LockToken'] = response['LockToken']
+        group_filepath = os.path.join(folder, f"{snapshot.RULE_GROUP_PREFIX}{group['Name']}.json")
+        with open(group_filepath, "w") as f:
+            json.dump(group, f, indent=2)
+
+    with ThreadPoolExecutor(max_workers=RULE_GROUP_FETCH_WORKERS) as pool:
+        list(pool.map(fetch, stale))
+    return snapshot.load_rule_groups(folder)
+
+
+def _list_all(call, key, **params):
+    items = []
+    while True:
+        response = call(**params)
+        items.extend(response.get(key, []))
+        marker = response.get('NextMarker')
+        if not marker:
+            return items
+        params['NextMarker'] = marker
+
+
+def import_web_acls(waf, scope, folder, snapshot_dir):
+    """Import every WebACL of one account/region/scope into folder, with the sets and groups they reference."""
+    os.makedirs(folder, exist_ok=True)
+    refs = load_refs(folder)
+    acl_filenames = []
+
+    # Fetch and save WebACLs
+    for acl in _list_all(waf.list_web_acls, 'WebACLs', Scope=scope):
+        acl_name = acl['Name']
+        acl_details = waf.get_web_acl(Name=acl_name, Scope=scope, Id=acl['Id'])
+
+        # Save WebACL as separate file
+        acl_filename = f"WebACL_{acl_name}.json"
+        with open(os.path.join(folder, acl_filename), "w") as f:
+            json.dump(sanitize_for_json(acl_details['WebACL']), f, indent=2)
+        acl_filenames.append(acl_filename)
+
+        forget_web_acl(refs, acl_name)
+        for rule in acl_details['WebACL'].get('Rules', []):
+            collect_references(rule.get('Statement'), rule.get('Name'), acl_name, refs)
+
+    # Save referenced rule groups, then pick up the IP sets / regex sets they reference
+    rule_groups = fetch_rule_groups(waf, scope, list(refs["rulegroup"]), folder)
+    for arn in refs["rulegroup"]:
+        group = rule_groups.get(arn, {})
+        # Recorded apart from WebACLs, which may have the same name
+        owner = RULE_GROUP_OWNER + group.get('Name', arn)
+        forget_web_acl(refs, owner)
+        for rule in group.get('Rules', []):
+            collect_references(rule.get('Statement'), rule.get('Name'), owner, refs)
+
+    # Index the WebACLs with their rule groups inlined
+    for acl_filename in acl_filenames:
+        snapshot.ingest(
+            os.path.join(folder, acl_filename),
+            snapshot.snapshot_path(snapshot_dir, acl_filename),
+            rule_groups,
+        )
+
+    # Save referenced IP sets
+    for arn, ref_info in refs["ipset"].items():
+        if not ref_info["rules"]:
+            continue
+        ipset = waf.get_ip_set(Name=ref_info['name'], Scope=scope, Id=arn.split('/')[-1])
+        with open(os.path.join(folder, f"IPSet_{ref_info['name']}.json"), "w") as f:
+            json.dump(sanitize_for_json(ipset['IPSet']), f, indent=2)
+
+    # Save referenced RegexPatternSets
+    for arn, ref_info in refs["regex"].items():
+        if not ref_info["rules"]:
+            continue
+        regexset = waf.get_regex_pattern_set(Name=ref_info['name'], Scope=scope, Id=arn.split('/')[-1])
+        with open(os.path.join(folder, f"RegexPatternSet_{ref_info['name']}.json"), "w") as f:
+            json.dump(sanitize_for_json(regexset['RegexPatternSet']), f, indent=2)
+
+    # Save references to files
+    save_refs(folder, refs)
+    return acl_filenames
@@ -0,0 +1,292 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+# Versioned catalog of managed rule groups (rule names, labels and WCU per group and version).
+#
+# The catalog lives in a single SQLite file. It is read lazily into an in-memory index on first
+# use, and re-read whenever the file changes on disk, so an import from another process is picked
+# up without restarting the app.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_DB = os.environ.get("WAF_CATALOG_DB", os.path.join(BASE_DIR, "managed-catalog.db"))
+SEED_LABELS_PATH = os.path.join(BASE_DIR, "aws-managedrules-labels.json")
+
+# Default capacities used to seed a fresh catalog
+SEED_CAPACITY = {
+    "AWSManagedRulesAdminProtectionRuleSet": 100,
+    "AWSManagedRulesAmazonIpReputationList": 25,
+    "AWSManagedRulesAnonymousIpList": 50,
+    "AWSManagedRulesCommonRuleSet": 700,
+    "AWSManagedRulesKnownBadInputsRuleSet": 200,
+    "AWSManagedRulesLinuxRuleSet": 200,
+    "AWSManagedRulesPHPRuleSet": 100,
+    "AWSManagedRulesPOSIXRuleSet": 100,
+    "AWSManagedRulesSQLiRuleSet": 200,
+    "AWSManagedRulesWindowsRuleSet": 200,
+    "AWSManagedRulesWordPressRuleSet": 100
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rule_groups (
+    vendor TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL DEFAULT '',
+    capacity INTEGER,
+    label_namespace TEXT,
+    imported_at TEXT NOT NULL,
+    PRIMARY KEY (vendor, name, version)
+);
+CREATE TABLE IF NOT EXISTS rules (
+    vendor TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL DEFAULT '',
+    rule_name TEXT NOT NULL,
+    PRIMARY KEY (vendor, name, version, rule_name)
+);
+CREATE TABLE IF NOT EXISTS labels (
+    vendor TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL DEFAULT '',
+    label TEXT NOT NULL,
+    PRIMARY KEY (vendor, name, version, label)
+);
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_lock = threading.Lock()
+_index = None  # { (vendor, name): { version: entry } }
+_stamp = None  # (mtime_ns, size) of the catalog file the index was read from
+
+
+def _connect(path=None):
+    conn = sqlite3.connect(path or CATALOG_DB)
+    conn.executescript(SCHEMA)
+    # Seed once per catalog file, whatever is written to it first (an import may come before any read)
+    if conn.execute("SELECT 1 FROM catalog_meta WHERE key = 'seeded'").fetchone() is None:
+        with conn:
+            marked = conn.execute(
+                "INSERT OR IGNORE INTO catalog_meta VALUES ('seeded', ?)", (datetime.utcnow().isoformat(),)
+            )
+            if marked.rowcount:
+                seed(conn)
+    return conn
+
+
+def _key(vendor, name):
+    return ((vendor or "").lower(), name or "")
+
+
+def store_group(conn, vendor, name, version="", capacity=None, rules=(), labels=(), label_namespace=None):
+    version = version or ""
+    conn.execute(
+        "INSERT OR REPLACE INTO rule_groups VALUES (?, ?, ?, ?, ?, ?)",
+        (vendor, name, version, capacity, label_namespace, datetime.utcnow().isoformat()),
+    )
+    conn.execute("DELETE FROM rules WHERE vendor = ? AND name = ? AND version = ?", (vendor, name, version))
+    conn.execute("DELETE FROM labels WHERE vendor = ? AND name = ? AND version = ?", (vendor, name, version))
+    conn.executemany("INSERT OR IGNORE INTO rules VALUES (?, ?, ?, ?)", [(vendor, name, version, r) for r in rules])
+    conn.executemany("INSERT OR IGNORE INTO labels VALUES (?, ?, ?, ?)", [(vendor, name, version, l) for l in labels])
+
+
+def seed(conn):
+    labels = {}
+    if os.path.exists(SEED_LABELS_PATH):
+        with open(SEED_LABELS_PATH) as f:
+            labels = json.load(f)
+    # Groups already in the catalog (e.g. imported from dumps) are left alone
+    existing = {name for (name,) in conn.execute("SELECT DISTINCT name FROM rule_groups WHERE lower(vendor) = 'aws'")}
+    for group in sorted((set(labels) | set(SEED_CAPACITY)) - existing):
+        store_group(conn, "AWS", group, capacity=SEED_CAPACITY.get(group), rules=labels.get(group, []))
+
+
+def _file_stamp():
+    try:
+        st = os.stat(CATALOG_DB)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_index():
+    conn = _connect()
+    try:
+        index = {}
+        for vendor, name, version, capacity, namespace, imported_at in conn.execute("SELECT * FROM rule_groups"):
+            index.setdefault(_key(vendor, name), {})[version] = {
+                "vendor": vendor,
+                "name": name,
+                "version": version,
+                "capacity": capacity,
+                "label_namespace": namespace,
+                "imported_at": imported_at,
+                "rules": [],
+                "labels": [],
+            }
+        for table, field in (("rules", "rule_name"), ("labels", "label")):
+            for vendor, name, version, value in conn.execute(
+                f"SELECT vendor, name, version, {field} FROM {table} ORDER BY {field}"
+            ):
+                entry = index.get(_key(vendor, name), {}).get(version)
+                if entry:
+                    entry[table].append(value)
+        return index
+    finally:
+        conn.close()
+
+
+def get_index():
+    global _index, _stamp
+    stamp = _file_stamp()
+    if _index is None or stamp != _stamp:
+        with _lock:
+            stamp = _file_stamp()
+            if _index is None or stamp != _stamp:
+                _index = _read_index()
+                # Seeding may have created the file, so stamp it after reading
+                _stamp = _file_stamp()
+    return _index
+
+
+def reload():
+    global _index
+    with _lock:
+        _index = None
+    return get_index()
+
+
+def stamp():
+    # Changes whenever the catalog content changes; used to invalidate anything derived from it
+    get_index()
+    return _stamp[0] if _stamp else 0
+
+
+def lookup(vendor, name, version=None):
+    versions = get_index().get(_key(vendor, name))
+    if not versions:
+        return None
+    if version and version in versions:
+        return versions[version]
+    # Unpinned (or unknown) version: use the most recently imported one
+    return max(versions.values(), key=lambda e: e["imported_at"])
+
+
+def rule_names(vendor, name, version=None):
+    entry = lookup(vendor, name, version)
+    return entry["rules"] if entry else []
+
+
+def labels(vendor, name, version=None):
+    entry = lookup(vendor, name, version)
+    return entry["labels"] if entry else []
+
+
+def capacity(vendor, name, version=None):
+    entry = lookup(vendor, name, version)
+    return entry["capacity"] if entry else None
+
+
+def describe_to_dump(waf, vendor, name, scope, version=None):
+    # Fetch a managed rule group description in the format accepted by import_dumps
+    params = {"VendorName": vendor, "Name": name, "Scope": scope}
+    if version:
+        params["VersionName"] = version
+    response = waf.describe_managed_rule_group(**params)
+    response.pop("ResponseMetadata", None)
+    response.update({"VendorName": vendor, "Name": name})
+    return response
+
+
+def import_dump(conn, dump, filename=None):
+    vendor = dump.get("VendorName")
+    name = dump.get("Name")
+    version = dump.get("VersionName", "")
+    if not (vendor and name) and filename:
+        # Dumps saved straight from the CLI don't carry the group name: Vendor__Name[__Version].json
+        parts = os.path.splitext(os.path.basename(filename))[0].split("__")
+        if len(parts) >= 2:
+            vendor, name = parts[0], parts[1]
+            version = version or (parts[2] if len(parts) > 2 else "")
+    if not (vendor and name):
+        raise ValueError(f"{filename or 'dump'}: missing VendorName/Name")
+
+    store_group(
+        conn,
+        vendor,
+        name,
+        version=version,
+        capacity=dump.get("Capacity"),
+        rules=[r["Name"] for r in dump.get("Rules", [])],
+        labels=[l["Name"] for l in dump.get("AvailableLabels", [])],
+        label_namespace=dump.get("LabelNamespace"),
+    )
+    return vendor, name, version
+
+
+def import_dumps(paths):
+    imported = []
+    conn = _connect()
+    try:
+        with conn:
+            for path in paths:
+                with open(path) as f:
+                    imported.append(import_dump(conn, json.load(f), path))
+    finally:
+        conn.close()
+    reload()
+    return imported
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Managed rule group catalog")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="import describe-managed-rule-group JSON dumps")
+    p_import.add_argument("paths", nargs="+")
+
+    p_fetch = sub.add_parser("fetch", help="fetch managed rule groups from AWS and import them")
+    p_fetch.add_argument("groups", nargs="+", help="Vendor/Name[@Version], e.g. AWS/AWSManagedRulesCommonRuleSet")
+    p_fetch.add_argument("--region", default="us-east-1")
+    p_fetch.add_argument("--scope", default="REGIONAL", choices=["REGIONAL", "CLOUDFRONT"])
+    p_fetch.add_argument("--out", help="also write the dumps to this directory")
+
+    sub.add_parser("list", help="list catalog entries")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        paths = [p for pattern in args.paths for p in sorted(glob.glob(pattern))]
+        for vendor, name, version in import_dumps(paths):
+            print(f"imported {vendor}/{name} {version or '(default)'}")
+    elif args.command == "fetch":
+        import boto3
+        waf = boto3.client("wafv2", region_name=args.region)
+        conn = _connect()
+        try:
+            with conn:
+                for spec in args.groups:
+                    group, _, version = spec.partition("@")
+                    vendor, _, name = group.partition("/")
+                    dump = describe_to_dump(waf, vendor, name, args.scope, version or None)
+                    if args.out:
+                        os.makedirs(args.out, exist_ok=True)
+                        filename = "__".join(p for p in (vendor, name, version) if p) + ".json"
+                        with open(os.path.join(args.out, filename), "w") as f:
+                            json.dump(dump, f, indent=2, default=str)
+                    import_dump(conn, dump)
+                    print(f"imported {vendor}/{name} {dump.get('VersionName') or '(default)'}")
+        finally:
+            conn.close()
+    else:
+        for versions in get_index().values():
+            for entry in versions.values():
+                print(
+                    f"{entry['vendor']}/{entry['name']} {entry['version'] or '(default)'}: "
+                    f"{entry['capacity']} WCU, {len(entry['rules'])} rules, {len(entry['labels'])} labels"
+                )
@@ -0,0 +1,244 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from jinja2 import Environment, FileSystemLoader
+
+import aws_import
+import catalog
+import mapping
+import rule_order
+import snapshot
+import waf_analyzer
+
+# Export WebACLs as a static site that mirrors the app's URLs:
+#
+#   index.html                          ACL list with WCU summaries
+#   viewRules/<file_id>/index.html      rule list and rule order findings
+#   view/<file_id>/<rule>/index.html    Mermaid graph
+#   view-vis/<file_id>/<rule>/index.html
+#   view-ipset/<file>/index.html, view-regex/<file>/index.html
+#
+# Host the output at the site root, since the templates link with absolute paths.
+# Per-rule pages are skipped when nothing that can appear in their graph has changed.
+
+EXPORT_VERSION = 2
+MANIFEST_NAME = ".export-manifest.json"
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+CHUNK_SIZE = 64
+
+_env = None
+_indexes = {}  # worker state: { file_id: (rules by name, producers, consumers, priorities) }
+
+
+def _environment():
+    global _env
+    if _env is None:
+        _env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=True)
+    return _env
+
+
+def _write_page(out_dir, url_path, template, **context):
+    path = os.path.join(out_dir, url_path, "index.html")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(_environment().get_template(template).render(**context))
+    return path
+
+
+def _templates_digest():
+    # Managed rule group labels come from the catalog, so a catalog import invalidates every page too
+    digest = hashlib.sha256(f"{EXPORT_VERSION}|{catalog.stamp()}".encode())
+    for name in ("layout.html", "viewer.html", "viewer_vis.html"):
+        with open(os.path.join(TEMPLATE_DIR, name), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _label_components(rules):
+    # Union-find over rules connected by a label key: a rule's graph can only contain rules of its component
+    parent = {}
+
+    def find(x):
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    produced = {label for rule in rules for label in mapping.produced_labels(rule)}
+    namespaces = mapping.namespace_index(produced)
+    for rule in rules:
+        node = ("rule", rule["Name"])
+        keys = mapping.produced_labels(rule)
+        for match in mapping.label_matches(rule.get("Statement", {})):
+            key = mapping.match_key(match)
+            # A NAMESPACE match joins the component of every label under the namespace
+            keys.extend(mapping.namespace_labels(namespaces, key) if mapping.is_namespace_key(key) else [key])
+        for key in keys:
+            parent[find(node)] = find(("label", mapping.label_key(key)))
+        find(node)
+
+    roots = {rule["Name"]: find(("rule", rule["Name"])) for rule in rules}
+    members = {}
+    for rule in rules:
+        members.setdefault(roots[rule["Name"]], []).append(rule)
+    return roots, members
+
+
+def rule_input_hashes(rules, templates_digest):
+    # { rule name: hash of everything its pages are rendered from }
+    roots, members = _label_components(rules)
+    component_hash = {
+        root: hashlib.sha256(
+            json.dumps(sorted(group, key=lambda r: r["Name"]), sort_keys=True).encode()
+        ).hexdigest()
+        for root, group in members.items()
+    }
+    return {
+        name: hashlib.sha256(f"{templates_digest}|{component_hash[root]}|{name}".encode()).hexdigest()
+        for name, root in roots.items()
+    }
+
+
+def _init_worker(indexes):
+    global _indexes
+    _indexes = indexes
+
+
+def _render_rules(task):
+    file_id, rule_names, out_dir = task
+    rules, producers, consumers, priorities = _indexes[file_id]
+    for rule_name in rule_names:
+        # Same edge walk as the app's streamed graphs, rendered inline
+        edges = list(mapping.iter_relationship_edges(rule_name, rules, producers, consumers, priorities=priorities))
+        graph = "\n".join(mapping.iter_mermaid(edges))
+        records = list(mapping.iter_vis_records(edges))
+        rule_statement = rules[rule_name].get("Statement")
+        _write_page(out_dir, f"view/{file_id}/{rule_name}", "viewer.html",
+                    graph=graph, rule_name=rule_name, rule_statement=rule_statement)
+        _write_page(out_dir, f"view-vis/{file_id}/{rule_name}", "viewer_vis.html",
+                    nodes=[r["node"] for r in records if "node" in r],
+                    edges=[r["edge"] for r in records if "edge" in r],
+                    rule_name=rule_name, rule_statement=rule_statement)
+    return len(rule_names)
+
+
+def _load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if os.path.isfile(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _export_sets(out_dir, acl_path, file_id):
+    # IP set and regex pattern set pages for the sets saved next to the WebACL
+    folder = os.path.dirname(acl_path)
+    prefix = os.path.dirname(file_id)
+    refs = aws_import.load_refs(folder)
+    pages = (("IPSet_", "view-ipset", "view_ipset.html", "ipset"),
+             ("RegexPatternSet_", "view-regex", "view_regex.html", "regex"))
+    for name in sorted(os.listdir(folder)):
+        for file_prefix, route, template, kind in pages:
+            if not (name.startswith(file_prefix) and name.endswith(".json")):
+                continue
+            with open(os.path.join(folder, name)) as f:
+                content = json.load(f)
+            rules = refs[kind].get(content.get("ARN", ""), {}).get("rules", [])
+            set_id = f"{prefix}/{name}" if prefix else name
+            if kind == "ipset":
+                _write_page(out_dir, f"{route}/{set_id}", template, ipset_name=content.get("Name", ""),
+                            ipset_content=content, rules=rules, active_page="mapper")
+            else:
+                _write_page(out_dir, f"{route}/{set_id}", template, regex_name=content.get("Name", ""),
+                            regex_content=content, rules=rules, active_page="mapper")
+
+
+def _file_ids(acl_paths, base_dir=None):
+    # Ids relative to base_dir (default: the folder all inputs share), so ACLs with the same file name
+    # in different folders, like uploads/<account>/<region>/<scope>/, keep apart
+    acl_paths = [os.path.abspath(p) for p in acl_paths]
+    if base_dir is None:
+        base_dir = os.path.commonpath([os.path.dirname(p) for p in acl_paths]) if acl_paths else "."
+    file_ids = []
+    for acl_path in acl_paths:
+        file_id = os.path.relpath(acl_path, os.path.abspath(base_dir))
+        # Pages are written under out_dir/<route>/<file id>, so the id must stay inside base_dir
+        if file_id == os.pardir or file_id.startswith(os.pardir + os.sep):
+            raise ValueError(f"{acl_path} is outside the base directory {base_dir}")
+        file_ids.append(file_id.replace(os.sep, "/"))
+    return file_ids
+
+
+def export_site(acl_paths, out_dir, base_dir=None, jobs=None, force=False):
+    """Returns (pages rendered, pages skipped)."""
+    # A file matched by several patterns is exported once
+    acl_paths = list({os.path.abspath(p): p for p in acl_paths}.values())
+    file_ids = _file_ids(acl_paths, base_dir)  # before anything is written
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {} if force else _load_manifest(out_dir)
+    templates_digest = _templates_digest()
+    indexes = {}
+    tasks = []
+    summaries = []
+    skipped = 0
+
+    for acl_path, file_id in zip(acl_paths, file_ids):
+        with open(acl_path) as f:
+            acl = json.load(f)
+
+        # Label index, computed once per ACL and shipped to the workers
+        rule_groups = snapshot.load_rule_groups(os.path.dirname(acl_path))
+        rules = mapping.expand_rule_groups(acl.get("Rules", []), rule_groups)
+        producers, consumers = mapping.find_label_relationships(rules)
+        priorities = {r["Name"]: r.get("Priority", 0) for r in rules}
+        changed = []
+        for rule_name, input_hash in rule_input_hashes(rules, templates_digest).items():
+            page = f"view/{file_id}/{rule_name}"
+            if manifest.get(page) == input_hash and os.path.isfile(os.path.join(out_dir, page, "index.html")):
+                skipped += 1
+                continue
+            manifest[page] = input_hash
+            changed.append(rule_name)
+        if changed:
+            indexes[file_id] = ({r["Name"]: r for r in rules}, producers, consumers, priorities)
+        for i in range(0, len(changed), CHUNK_SIZE):
+            tasks.append((file_id, changed[i:i + CHUNK_SIZE], out_dir))
+
+        # ACL level pages are cheap, so they are always rendered
+        analysis = rule_order.analyze_rule_order(rules)
+        _write_page(out_dir, f"viewRules/{file_id}", "view_rules.html",
+                    rules=analysis["rules"], analysis=analysis, file_id=file_id)
+        _export_sets(out_dir, acl_path, file_id)
+        summaries.append({"file_id": file_id, "name": acl.get("Name", file_id), "rules": len(rules),
+                          "wcu": waf_analyzer.calculate_wcu_static(acl)})
+
+    rendered = 0
+    if tasks:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(indexes,)) as pool:
+            rendered = sum(pool.map(_render_rules, tasks))
+
+    _write_page(out_dir, "", "export_index.html", acls=summaries, active_page="mapper")
+    with open(os.path.join(out_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+    return rendered, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export WebACL rule graphs as a static site")
+    parser.add_argument("acls", nargs="+", help="WebACL JSON files or globs")
+    parser.add_argument("--out", default="site")
+    parser.add_argument("--base-dir", help="file ids are relative to this folder (default: the folder all inputs share)")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="re-render every page")
+    args = parser.parse_args()
+
+    paths = list(dict.fromkeys(p for pattern in args.acls for p in sorted(glob.glob(pattern, recursive=True))))
+    try:
+        rendered, skipped = export_site(paths, args.out, args.base_dir, args.jobs, args.force)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{len(paths)} WebACLs: {rendered} rule pages rendered, {skipped} unchanged")
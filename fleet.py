@@ -0,0 +1,190 @@
+import argparse
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+import boto3
+from botocore.config import Config
+
+import aws_import
+
+# Import every WebACL of many accounts x regions concurrently.
+#
+# Each role is assumed once and its account/region pairs are imported in parallel into
+# uploads/<account>/<region>/<scope>/. All WAF API calls share one global concurrency cap, and
+# each account has its own token bucket so a single account can't be throttled by AWS.
+
+DEFAULT_MAX_WORKERS = 16
+DEFAULT_ACCOUNT_RATE = 5  # API calls per second per account
+ROLE_SESSION_NAME = "waf-label-visualizer"
+CLIENT_CONFIG = Config(retries={"mode": "adaptive", "max_attempts": 10})
+ROLE_ARN_PATTERN = re.compile(r"^arn:aws[\w-]*:iam::\d{12}:role/\S+$")
+
+
+class RateLimiter:
+    """Token bucket shared by every thread calling into the same account."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ThrottledClient:
+    """Proxy for a boto3 client: each API call waits for its account's limiter and a global slot."""
+
+    def __init__(self, client, limiter, semaphore):
+        self._client = client
+        self._limiter = limiter
+        self._semaphore = semaphore
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr) or name not in self._client.meta.method_to_api_mapping:
+            return attr
+
+        def call(*args, **kwargs):
+            self._limiter.acquire()
+            with self._semaphore:
+                return attr(*args, **kwargs)
+        return call
+
+
+def invalid_role_arns(role_arns):
+    return [arn for arn in role_arns if not ROLE_ARN_PATTERN.match(arn)]
+
+
+def account_id(role_arn):
+    # arn:aws:iam::123456789012:role/name
+    return role_arn.split(":")[4]
+
+
+def namespace(account, region, scope):
+    return os.path.join(account, region, scope)
+
+
+def import_fleet(
+    role_arns,
+    regions,
+    upload_folder,
+    snapshot_folder,
+    max_workers=DEFAULT_MAX_WORKERS,
+    account_rate=DEFAULT_ACCOUNT_RATE,
+    base_session=None,
+    sts_endpoint_url=None,
+    wafv2_endpoint_url=None,
+    session_factory=boto3.Session,
+):
+    """Returns ({namespace: [imported WebACL files]}, {(role_arn, region): error}).
+
+    session_factory builds the session of each assumed role from its credentials (a stub in tests).
+    """
+    invalid = invalid_role_arns(role_arns)
+    if invalid:
+        raise ValueError(f"Invalid role ARNs: {', '.join(invalid)}")
+    base_session = base_session or boto3.Session()
+    semaphore = threading.BoundedSemaphore(max_workers)
+    limiters = {account_id(arn): RateLimiter(account_rate) for arn in role_arns}
+    sessions = {}  # role ARN -> Future of its session, so each role is assumed once
+    # boto3 sessions are not thread-safe when creating clients; the lock covers nothing else
+    session_lock = threading.Lock()
+
+    def session_for(role_arn):
+        with session_lock:
+            future = sessions.get(role_arn)
+            owner = future is None
+            if owner:
+                future = sessions[role_arn] = Future()
+        if owner:
+            # Assume the role outside the lock: other roles, and client creation, don't wait on STS
+            try:
+                with session_lock:
+                    sts = base_session.client("sts", endpoint_url=sts_endpoint_url, config=CLIENT_CONFIG)
+                limiters[account_id(role_arn)].acquire()
+                creds = sts.assume_role(RoleArn=role_arn, RoleSessionName=ROLE_SESSION_NAME)["Credentials"]
+                future.set_result(session_factory(
+                    aws_access_key_id=creds["AccessKeyId"],
+                    aws_secret_access_key=creds["SecretAccessKey"],
+                    aws_session_token=creds["SessionToken"],
+                ))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def run(role_arn, region):
+        account = account_id(role_arn)
+        boto_region, scope = aws_import.scope_for_region(region)
+        session = session_for(role_arn)
+        with session_lock:
+            client = session.client(
+                "wafv2", region_name=boto_region, endpoint_url=wafv2_endpoint_url, config=CLIENT_CONFIG
+            )
+        waf = ThrottledClient(client, limiters[account], semaphore)
+        ns = namespace(account, region, scope)
+        files = aws_import.import_web_acls(
+            waf, scope, os.path.join(upload_folder, ns), os.path.join(snapshot_folder, ns)
+        )
+        return ns, files
+
+    imported = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(run, role_arn, region): (role_arn, region)
+            for role_arn in role_arns
+            for region in regions
+        }
+        for future in as_completed(futures):
+            try:
+                ns, files = future.result()
+                imported[ns] = files
+            except Exception as e:
+                errors[futures[future]] = str(e)
+    return imported, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import WebACLs from many accounts and regions")
+    parser.add_argument("--roles", required=True, help="file with one role ARN per line")
+    parser.add_argument("--regions", required=True, help="comma separated, 'global' for CloudFront")
+    parser.add_argument("--uploads", default="uploads")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--account-rate", type=float, default=DEFAULT_ACCOUNT_RATE)
+    parser.add_argument("--sts-endpoint-url", help="e.g. a local STS stub for offline runs")
+    parser.add_argument("--wafv2-endpoint-url", help="e.g. a local WAFV2 stub for offline runs")
+    args = parser.parse_args()
+
+    with open(args.roles) as f:
+        roles = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if invalid_role_arns(roles):
+        parser.error(f"invalid role ARNs in {args.roles}: {', '.join(invalid_role_arns(roles))}")
+    imported, errors = import_fleet(
+        roles,
+        [r.strip() for r in args.regions.split(",") if r.strip()],
+        args.uploads,
+        os.path.join(args.uploads, "snapshots"),
+        max_workers=args.max_workers,
+        account_rate=args.account_rate,
+        sts_endpoint_url=args.sts_endpoint_url,
+        wafv2_endpoint_url=args.wafv2_endpoint_url,
+    )
+    for ns, files in sorted(imported.items()):
+        print(f"{ns}: {len(files)} WebACLs")
+    for (role_arn, region), error in sorted(errors.items()):
+        print(f"FAILED {role_arn} {region}: {error}")
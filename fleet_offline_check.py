@@ -0,0 +1,135 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+import aws_import
+import fleet
+import snapshot
+
+# Offline check of fleet.import_fleet against botocore Stubbers for STS and WAFV2: no network, no
+# credentials. Every account/region pair serves one WebACL referencing a rule group, which itself
+# references an IP set; the check asserts each pair is imported into its own namespace, with its
+# snapshot, the rule group inlined and the IP set saved, and that every stubbed call was made.
+#
+#   python fleet_offline_check.py
+
+ROLE_ARNS = ["arn:aws:iam::111111111111:role/waf-reader", "arn:aws:iam::222222222222:role/waf-reader"]
+REGIONS = ["us-east-1", "eu-west-1", "global"]
+FAKE_KEY = "AKIAOFFLINECHECK0000"
+VISIBILITY = {"SampledRequestsEnabled": False, "CloudWatchMetricsEnabled": False, "MetricName": "m"}
+
+
+def _client(service, region):
+    session = boto3.Session(aws_access_key_id=FAKE_KEY, aws_secret_access_key="offline", region_name=region)
+    return session.client(service, region_name=region)
+
+
+def _wafv2_responses(region):
+    # (method, response, expected params) in the order aws_import.import_web_acls calls them
+    prefix = f"arn:aws:wafv2:{region}:111111111111"
+    group_arn = f"{prefix}:regional/rulegroup/shared/g-1"
+    ipset_arn = f"{prefix}:regional/ipset/blocked/ip-1"
+    acl = {
+        "Name": "edge", "Id": "acl-1", "ARN": f"{prefix}:regional/webacl/edge/acl-1",
+        "DefaultAction": {"Allow": {}}, "VisibilityConfig": VISIBILITY,
+        "Rules": [{
+            "Name": "UseShared", "Priority": 0, "OverrideAction": {"None": {}},
+            "Statement": {"RuleGroupReferenceStatement": {"ARN": group_arn}}, "VisibilityConfig": VISIBILITY,
+        }],
+    }
+    group = {
+        "Name": "shared", "Id": "g-1", "ARN": group_arn, "Capacity": 1, "VisibilityConfig": VISIBILITY,
+        "Rules": [{
+            "Name": "BlockBad", "Priority": 0, "Action": {"Block": {}},
+            "Statement": {"IPSetReferenceStatement": {"ARN": ipset_arn}}, "VisibilityConfig": VISIBILITY,
+        }],
+    }
+    ipset = {"Name": "blocked", "Id": "ip-1", "ARN": ipset_arn, "IPAddressVersion": "IPV4", "Addresses": ["192.0.2.0/24"]}
+    return [
+        ("list_web_acls", {"WebACLs": [{"Name": "edge", "Id": "acl-1", "ARN": acl["ARN"], "LockToken": "a"}]},
+         {"Scope": ANY}),
+        ("get_web_acl", {"WebACL": acl, "LockToken": "a"}, {"Name": "edge", "Scope": ANY, "Id": "acl-1"}),
+        ("list_rule_groups", {"RuleGroups": [{"Name": "shared", "Id": "g-1", "ARN": group_arn, "LockToken": "g"}]},
+         {"Scope": ANY, "Limit": 100}),
+        ("get_rule_group", {"RuleGroup": group, "LockToken": "g"}, {"ARN": group_arn}),
+        ("get_ip_set", {"IPSet": ipset, "LockToken": "i"}, {"Name": "blocked", "Scope": ANY, "Id": "ip-1"}),
+    ]
+
+
+class StubSession:
+    """Stands in for an assumed-role boto3 Session: every client it creates is a stubbed WAFV2 client."""
+
+    stubbers = []
+
+    def __init__(self, **credentials):
+        assert credentials["aws_access_key_id"] == FAKE_KEY
+
+    def client(self, service, region_name=None, **kwargs):
+        assert service == "wafv2"
+        client = _client("wafv2", region_name)
+        stubber = Stubber(client)
+        for method, response, expected in _wafv2_responses(region_name):
+            stubber.add_response(method, response, expected)
+        stubber.activate()
+        StubSession.stubbers.append(stubber)
+        return client
+
+
+class StubBaseSession:
+    """The caller's session: its STS client answers one AssumeRole per role."""
+
+    def __init__(self):
+        self.sts = _client("sts", "us-east-1")
+        self.stubber = Stubber(self.sts)
+        expiration = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        for _ in ROLE_ARNS:
+            # Roles are assumed concurrently, so the order of the requests isn't fixed
+            self.stubber.add_response("assume_role", {"Credentials": {
+                "AccessKeyId": FAKE_KEY, "SecretAccessKey": "offline", "SessionToken": "offline",
+                "Expiration": expiration,
+            }}, {"RoleArn": ANY, "RoleSessionName": fleet.ROLE_SESSION_NAME})
+        self.stubber.activate()
+
+    def client(self, service, **kwargs):
+        assert service == "sts"
+        return self.sts
+
+
+def main():
+    base_session = StubBaseSession()
+    with tempfile.TemporaryDirectory() as uploads:
+        snapshots = os.path.join(uploads, "snapshots")
+        imported, errors = fleet.import_fleet(
+            ROLE_ARNS, REGIONS, uploads, snapshots, max_workers=4,
+            base_session=base_session, session_factory=StubSession,
+        )
+        assert not errors, errors
+
+        expected = {
+            fleet.namespace(fleet.account_id(arn), region, aws_import.scope_for_region(region)[1])
+            for arn in ROLE_ARNS for region in REGIONS
+        }
+        assert set(imported) == expected, sorted(imported)
+        for ns, files in sorted(imported.items()):
+            assert files == ["WebACL_edge.json"], (ns, files)
+            folder = os.path.join(uploads, ns)
+            assert os.path.isfile(os.path.join(folder, "IPSet_blocked.json")), ns
+            snap = snapshot.Snapshot(snapshot.snapshot_path(os.path.join(snapshots, ns), files[0]))
+            assert "UseShared.BlockBad" in snap.rules, (ns, list(snap.rules))
+            print(f"ok  {ns}")
+
+    base_session.stubber.assert_no_pending_responses()
+    for stubber in StubSession.stubbers:
+        stubber.assert_no_pending_responses()
+    print(f"{len(expected)} account/region pairs imported offline")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except AssertionError as e:
+        sys.exit(f"FAILED: {e}")
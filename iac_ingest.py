@@ -0,0 +1,425 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+import snapshot
+
+try:
+    import hcl2
+except ImportError:  # optional, only needed for .tf files (.tf.json is plain JSON)
+    hcl2 = None
+
+# WebACLs and rule groups from Terraform (aws_wafv2_web_acl / aws_wafv2_rule_group, .tf and .tf.json)
+# and CloudFormation (AWS::WAFv2::WebACL / AWS::WAFv2::RuleGroup, YAML or JSON), converted to the
+# same JSON as a WAFV2 API export so they can be uploaded, mapped and WCU-analyzed like any other ACL.
+#
+# Variables, modules and dynamic blocks are not evaluated: unresolved values are kept as "${...}"
+# expressions. References to rule groups defined in the same tree are kept as consistent synthetic
+# ARNs ("${aws_wafv2_rule_group.name.arn}", "${Logical.Arn}"), so the groups are still inlined.
+#
+# Bulk ingestion parses files in parallel and caches each file's result by content hash, so
+# re-indexing a large repository only parses the files that changed.
+
+IAC_VERSION = 1
+SKIP_DIRS = {".git", ".terraform", "node_modules", ".venv", "venv", "__pycache__"}
+CFN_EXTENSIONS = (".yaml", ".yml", ".json", ".template")
+
+# Terraform names whose API field isn't simply the CamelCase of the name
+TF_NAMES = {
+    "arn": "ARN",
+    "cloudwatch_metrics_enabled": "CloudWatchMetricsEnabled",
+    "ip_set_reference_statement": "IPSetReferenceStatement",
+    "ip_set_forwarded_ip_config": "IPSetForwardedIPConfig",
+    "forwarded_ip_config": "ForwardedIPConfig",
+    "ja3_fingerprint": "JA3Fingerprint",
+}
+# Repeated Terraform blocks, which the API holds in a plural list
+TF_LISTS = {
+    "rule": "Rules",
+    "rule_label": "RuleLabels",
+    "text_transformation": "TextTransformations",
+    "excluded_rule": "ExcludedRules",
+    "rule_action_override": "RuleActionOverrides",
+    "managed_rule_group_configs": "ManagedRuleGroupConfigs",
+    "custom_key": "CustomKeys",
+}
+# Terraform-only resource arguments with no API counterpart
+TF_IGNORED = {"tags", "tags_all", "lifecycle", "depends_on", "provider", "count", "for_each"}
+TF_RESOURCES = {"aws_wafv2_web_acl": "WebACL", "aws_wafv2_rule_group": "RuleGroup"}
+CFN_RESOURCES = {"AWS::WAFv2::WebACL": "WebACL", "AWS::WAFv2::RuleGroup": "RuleGroup"}
+
+
+class CloudFormationLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    """Safe YAML loader that also understands CloudFormation short-form intrinsics (!Ref, !GetAtt, ...)."""
+
+
+def _construct_intrinsic(loader, suffix, node):
+    name = "Ref" if suffix == "Ref" else f"Fn::{suffix}"
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+        if suffix == "GetAtt":
+            value = value.split(".", 1)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    return {name: value}
+
+
+CloudFormationLoader.add_multi_constructor("!", _construct_intrinsic)
+
+
+def _camel(name):
+    return TF_NAMES.get(name) or "".join(part.capitalize() for part in name.split("_"))
+
+
+def _tf_value(value):
+    # python-hcl2 may keep the quotes around string literals
+    if isinstance(value, str) and len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def _tf_block(block, parent=None):
+    """Convert a Terraform block (HCL or .tf.json) to its API form."""
+    converted = {}
+    for key, value in block.items():
+        # python-hcl2 adds "__is_block__" / "__start_line__" style metadata
+        if key.startswith("__") or key == "dynamic" or (parent is None and key in TF_IGNORED):
+            continue
+        value = _tf_value(value)
+        if isinstance(value, dict):
+            value = [value]  # .tf.json may write a single block as an object
+        is_block = isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+        if not is_block:
+            if isinstance(value, list):
+                value = [_tf_value(v) for v in value]
+            if key == "arn" and isinstance(value, str) and not value.startswith(("arn:", "${")):
+                value = "${" + value + "}"
+            converted[_camel(key)] = value
+        elif key == "statement" and parent in ("and_statement", "or_statement"):
+            converted["Statements"] = [_tf_block(v, key) for v in value]
+        elif key in TF_LISTS:
+            converted[TF_LISTS[key]] = [_tf_block(v, key) for v in value]
+        else:
+            converted[_camel(key)] = _tf_block(value[0], key)
+    return converted
+
+
+def _tf_resources(document):
+    # (resource type, label, body) for every resource, from hcl2's or .tf.json's layout
+    resources = document.get("resource", [])
+    if isinstance(resources, dict):
+        resources = [resources]
+    for entry in resources:
+        for resource_type, instances in entry.items():
+            if isinstance(instances, list):
+                instances = {k: v for item in instances for k, v in item.items()}
+            for label, body in instances.items():
+                if isinstance(body, list):
+                    body = body[0]
+                yield _tf_value(resource_type), _tf_value(label), body
+
+
+def _numeric(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _normalize(kind, resource, name, arn):
+    # Fill in what the rest of the app relies on: a usable Name, numeric priorities and, for rule
+    # groups, an ARN and a LockToken that changes with the content (so snapshots get rebuilt)
+    if not isinstance(resource.get("Name"), str) or "${" in resource.get("Name", "${"):
+        resource["Name"] = name
+    rules = resource.get("Rules", [])
+    for i, rule in enumerate(rules):
+        rule["Priority"] = _numeric(rule.get("Priority"), i)
+    if kind == "RuleGroup":
+        resource["ARN"] = arn
+        resource["LockToken"] = hashlib.sha1(json.dumps(rules, sort_keys=True, default=str).encode()).hexdigest()
+    return resource
+
+
+def extract_terraform(document):
+    """[(kind, resource)] for the WAF resources of a parsed .tf / .tf.json document."""
+    extracted = []
+    for resource_type, label, body in _tf_resources(document):
+        kind = TF_RESOURCES.get(resource_type)
+        if kind:
+            resource = _tf_block(body)
+            extracted.append((kind, _normalize(kind, resource, label, f"${{{resource_type}.{label}.arn}}")))
+    return extracted
+
+
+def _cfn_resolve(value, parameters):
+    if isinstance(value, list):
+        return [_cfn_resolve(v, parameters) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if len(value) == 1:
+        (fn, arg), = value.items()
+        if fn == "Ref":
+            default = parameters.get(arg, {}).get("Default")
+            return default if isinstance(default, str) else f"${{{arg}}}"
+        if fn == "Fn::GetAtt":
+            return "${" + ".".join(arg if isinstance(arg, list) else arg.split(".")) + "}"
+        if fn == "Fn::Sub":
+            return arg if isinstance(arg, str) else arg[0]
+        if fn.startswith("Fn::"):
+            return "${" + fn + "}"
+    # CloudFormation spells the reference statements' ARN property "Arn"
+    return {("ARN" if k == "Arn" else k): _cfn_resolve(v, parameters) for k, v in value.items()}
+
+
+def extract_cloudformation(template):
+    """[(kind, resource)] for the WAF resources of a parsed CloudFormation template."""
+    extracted = []
+    parameters = template.get("Parameters") or {}
+    for logical_id, resource in (template.get("Resources") or {}).items():
+        kind = CFN_RESOURCES.get(resource.get("Type"))
+        if kind:
+            properties = _cfn_resolve(resource.get("Properties") or {}, parameters)
+            extracted.append((kind, _normalize(kind, properties, logical_id, f"${{{logical_id}.Arn}}")))
+    return extracted
+
+
+def source_kind(path):
+    if path.endswith(".tf.json"):
+        return "tf.json"
+    if path.endswith(".tf"):
+        return "tf"
+    if path.endswith(CFN_EXTENSIONS):
+        return "cfn"
+    return None
+
+
+def parse_document(text, kind):
+    if kind == "tf":
+        if hcl2 is None:
+            raise RuntimeError("python-hcl2 is required to read .tf files (pip install python-hcl2)")
+        return hcl2.loads(text)
+    if kind == "tf.json":
+        return json.loads(text)
+    return yaml.load(text, Loader=CloudFormationLoader)
+
+
+def extract_document(document):
+    # Terraform JSON has a top-level "resource", CloudFormation has "Resources"
+    if isinstance(document, dict) and "resource" in document:
+        return extract_terraform(document)
+    if isinstance(document, dict) and "Resources" in document:
+        return extract_cloudformation(document)
+    return []
+
+
+def extract_source(kind, data):
+    """Parse one file's bytes. Runs in worker processes."""
+    return extract_document(parse_document(data.decode("utf-8"), kind))
+
+
+def _is_candidate(kind, data):
+    # Cheap byte check so the bulk of a monorepo is never parsed
+    return (b"aws_wafv2_" if kind in ("tf", "tf.json") else b"AWS::WAFv2::") in data
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+def _referenced_groups(statement, found):
+    if isinstance(statement, dict):
+        ref = statement.get("RuleGroupReferenceStatement")
+        if ref and ref.get("ARN"):
+            found.add(ref["ARN"])
+        for value in statement.values():
+            _referenced_groups(value, found)
+    elif isinstance(statement, list):
+        for item in statement:
+            _referenced_groups(item, found)
+    return found
+
+
+def _write_if_changed(path, payload):
+    # Unchanged outputs keep their mtime, so their snapshots stay valid
+    data = json.dumps(payload, indent=2, default=str)
+    if os.path.isfile(path):
+        with open(path) as f:
+            if f.read() == data:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(data)
+    return True
+
+
+def write_resources(by_folder, out_dir, snapshot_dir=None, upload_dir=None):
+    """Write { folder: [(kind, resource)] } under out_dir. Returns (written paths, changed paths).
+
+    Rule groups are also written next to every WebACL that references them, since rule groups are
+    looked up in the WebACL's folder. Snapshots of changed WebACLs are rebuilt when snapshot_dir is set
+    (file ids are relative to upload_dir).
+    """
+    groups = {r["ARN"]: r for items in by_folder.values() for kind, r in items if kind == "RuleGroup"}
+    written, changed = [], []
+    for folder, items in sorted(by_folder.items()):
+        folder_groups = {r["ARN"]: r for kind, r in items if kind == "RuleGroup"}
+        for kind, resource in items:
+            if kind == "WebACL":
+                for arn in _referenced_groups(resource.get("Rules", []), set()):
+                    if arn in groups:
+                        folder_groups.setdefault(arn, groups[arn])
+
+        folder_path = os.path.join(out_dir, folder)
+        group_changed = False
+        for group in folder_groups.values():
+            path = os.path.join(folder_path, f"{snapshot.RULE_GROUP_PREFIX}{_safe_name(group['Name'])}.json")
+            written.append(path)
+            if _write_if_changed(path, group):
+                changed.append(path)
+                group_changed = True
+
+        acl_paths = []
+        for kind, resource in items:
+            if kind != "WebACL":
+                continue
+            path = os.path.join(folder_path, f"WebACL_{_safe_name(resource['Name'])}.json")
+            written.append(path)
+            if _write_if_changed(path, resource) or group_changed:
+                changed.append(path)
+                acl_paths.append(path)
+
+        if snapshot_dir and acl_paths:
+            rule_groups = snapshot.load_rule_groups(folder_path)
+            for path in acl_paths:
+                file_id = os.path.relpath(path, upload_dir or out_dir)
+                snapshot.ingest(path, snapshot.snapshot_path(snapshot_dir, file_id), rule_groups)
+    return written, changed
+
+
+def ingest_file(filename, data, out_dir, snapshot_dir=None, upload_dir=None):
+    """Extract a single uploaded template into out_dir. Returns the written WebACL/RuleGroup paths."""
+    kind = source_kind(filename)
+    if kind is None:
+        raise ValueError(f"{filename}: not a Terraform or CloudFormation file")
+    resources = extract_source(kind, data)
+    if not resources:
+        raise ValueError(f"{filename}: no aws_wafv2_web_acl / AWS::WAFv2 resources found")
+    written, _ = write_resources({"": resources}, out_dir, snapshot_dir, upload_dir)
+    return written
+
+
+def _walk(root):
+    for dirpath, dirs, names in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS)
+        for name in sorted(names):
+            kind = source_kind(name)
+            if kind:
+                yield os.path.join(dirpath, name), kind
+
+
+def _parse_task(task):
+    kind, data = task
+    try:
+        return extract_source(kind, data), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def ingest_directory(root, out_dir, cache_dir, snapshot_dir=None, upload_dir=None, jobs=None):
+    """Extract every WebACL and rule group under root into out_dir, mirroring root's folders.
+
+    Returns a dict with written / changed / removed paths, parse errors by file and parse statistics.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    results = {}  # { path: [(kind, resource)] }
+    pending = []  # (path, kind, data, cache path)
+    errors = {}
+    cached = 0
+
+    for path, kind in _walk(root):
+        with open(path, "rb") as f:
+            data = f.read()
+        if not _is_candidate(kind, data):
+            continue
+        digest = hashlib.sha256(f"{IAC_VERSION}|{kind}|".encode() + data).hexdigest()
+        cache_path = os.path.join(cache_dir, f"{digest}.json")
+        if os.path.isfile(cache_path):
+            with open(cache_path) as f:
+                results[path] = [tuple(item) for item in json.load(f)]
+            cached += 1
+        else:
+            pending.append((path, kind, data, cache_path))
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            parsed = pool.map(_parse_task, [(kind, data) for _, kind, data, _ in pending], chunksize=16)
+            for (path, _, _, cache_path), (resources, error) in zip(pending, parsed):
+                if error:
+                    errors[path] = error
+                    continue
+                with open(cache_path, "w") as f:
+                    json.dump(resources, f, default=str)
+                results[path] = resources
+
+    by_folder = {}
+    for path, resources in results.items():
+        if resources:
+            folder = os.path.relpath(os.path.dirname(path), root)
+            by_folder.setdefault("" if folder == "." else folder, []).extend(resources)
+    written, changed = write_resources(by_folder, out_dir, snapshot_dir, upload_dir)
+
+    # Drop outputs of ACLs / groups that no longer exist in the tree
+    manifest_path = os.path.join(
+        cache_dir, f"manifest-{hashlib.sha1(os.path.abspath(out_dir).encode()).hexdigest()[:12]}.json"
+    )
+    removed = []
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            removed = sorted(set(json.load(f)) - set(written))
+        for path in removed:
+            if os.path.isfile(path):
+                os.remove(path)
+    with open(manifest_path, "w") as f:
+        json.dump(written, f)
+
+    return {
+        "written": written,
+        "changed": changed,
+        "removed": removed,
+        "errors": errors,
+        "parsed": len(pending) - len(errors),
+        "cached": cached,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import WebACLs and rule groups from Terraform / CloudFormation")
+    parser.add_argument("root", help="directory to scan for .tf, .tf.json and CloudFormation templates")
+    parser.add_argument("--uploads", default="uploads")
+    parser.add_argument("--name", help="folder under uploads/iac/ (default: the root folder's name)")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    name = args.name or os.path.basename(os.path.abspath(args.root))
+    snapshot_dir = os.path.join(args.uploads, "snapshots")
+    result = ingest_directory(
+        args.root,
+        os.path.join(args.uploads, "iac", name),
+        os.path.join(snapshot_dir, "iac-cache"),
+        snapshot_dir=snapshot_dir,
+        upload_dir=args.uploads,
+        jobs=args.jobs,
+    )
+    print(
+        f"{result['parsed']} files parsed, {result['cached']} cached: {len(result['written'])} outputs, "
+        f"{len(result['changed'])} changed, {len(result['removed'])} removed"
+    )
+    for path, error in sorted(result["errors"].items()):
+        print(f"FAILED {path}: {error}")
@@ -0,0 +1,396 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+import mapping
+
+try:
+    import orjson
+except ImportError:  # optional, about 3x faster than json on WAF log lines
+    orjson = None
+
+# Hit counts from AWS WAF logs, per WebACL and time window.
+#
+# Log files (JSONL, optionally gzipped, as delivered to S3 / CloudWatch exports) are read in parallel
+# chunks. Each chunk is decoded into columnar integer arrays (strings are interned to codes) and reduced
+# with vectorized group-bys, so only small per-window tables cross process boundaries:
+#
+#   requests      (acl, window)               requests seen
+#   matches       (acl, window, rule)         rule matched (terminating or not)
+#   terminations  (acl, window, rule)         rule was the terminatingRuleId
+#   labels        (acl, window, label)        label present on the request
+#   edges         (acl, window, rule, label)  rule matched on a request carrying the label
+#
+# Tables are written to uploads/traffic/ (one .npz per WebACL ARN) and drawn by /view-vis as edge
+# widths and heat colors. Rules inside rule groups are recorded as "<ruleGroupId>#<ruleId>", and the
+# group itself as "<ruleGroupId>" whenever any of its rules matched.
+
+DEFAULT_WINDOW_SECONDS = 300
+CHUNK_BYTES = 64 * 1024 * 1024
+TABLES = {
+    "requests": ("acl", "window"),
+    "matches": ("acl", "window", "rule"),
+    "terminations": ("acl", "window", "rule"),
+    "labels": ("acl", "window", "label"),
+    "edges": ("acl", "window", "rule", "label"),
+}
+VOCABS = ("acl", "rule", "label")
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+
+def _read_lines(path, start, end):
+    # Lines starting in [start, end); gzip files can't be split and are always read whole
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            yield from f
+        return
+    with open(path, "rb") as f:
+        pos = start
+        if start:
+            f.seek(start - 1)
+            pos = start - 1 + len(f.readline())  # finish the line owned by the previous chunk
+        for line in f:
+            if pos >= end:
+                return
+            pos += len(line)
+            yield line
+
+
+def _decode(lines):
+    """Columnar view of a chunk of log lines: (vocabularies, { column: np.ndarray })."""
+    vocabs = {kind: {} for kind in VOCABS}
+    acls, rules, labels = vocabs["acl"], vocabs["rule"], vocabs["label"]
+    req_acl, req_ts, req_term = array("q"), array("q"), array("q")
+    match_req, match_rule = array("q"), array("q")
+    label_req, label_code = array("q"), array("q")
+
+    req = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        record = _loads(line)
+        req_acl.append(acls.setdefault(record.get("webaclId", ""), len(acls)))
+        req_ts.append(record.get("timestamp", 0))
+
+        matched = set()
+        terminating = record.get("terminatingRuleId")
+        if terminating and record.get("terminatingRuleType") != "DEFAULT" and terminating != "Default_Action":
+            matched.add(terminating)
+            req_term.append(rules.setdefault(terminating, len(rules)))
+        else:
+            req_term.append(-1)
+        for rule in record.get("nonTerminatingMatchingRules") or ():
+            matched.add(rule.get("ruleId"))
+        for group in record.get("ruleGroupList") or ():
+            group_id = group.get("ruleGroupId")
+            inner = [r.get("ruleId") for r in group.get("nonTerminatingMatchingRules") or ()]
+            if group.get("terminatingRule"):
+                inner.append(group["terminatingRule"].get("ruleId"))
+            if inner:
+                matched.add(group_id)
+                matched.update(f"{group_id}#{rule_id}" for rule_id in inner)
+        matched.discard(None)
+        for rule in matched:
+            match_req.append(req)
+            match_rule.append(rules.setdefault(rule, len(rules)))
+
+        for label in record.get("labels") or ():
+            label_req.append(req)
+            label_code.append(labels.setdefault(label.get("name", ""), len(labels)))
+        req += 1
+
+    columns = {
+        name: np.frombuffer(buf, dtype=np.int64)
+        for name, buf in (
+            ("req_acl", req_acl), ("req_ts", req_ts), ("req_term", req_term),
+            ("match_req", match_req), ("match_rule", match_rule),
+            ("label_req", label_req), ("label_code", label_code),
+        )
+    }
+    return {kind: list(vocab) for kind, vocab in vocabs.items()}, columns
+
+
+def _group_sum(keys, weights=None):
+    """Vectorized GROUP BY keys: (distinct key columns, summed weights, or row counts)."""
+    if not len(keys[0]):
+        return [np.empty(0, dtype=np.int64) for _ in keys], np.empty(0, dtype=np.int64)
+    lows = [k.min() for k in keys]
+    dims = tuple(int(k.max() - low) + 1 for k, low in zip(keys, lows))
+    flat = np.ravel_multi_index([k - low for k, low in zip(keys, lows)], dims)
+    distinct, inverse = np.unique(flat, return_inverse=True)
+    sums = np.bincount(inverse.ravel(), weights=weights, minlength=len(distinct))
+    columns = [c.astype(np.int64) + low for c, low in zip(np.unravel_index(distinct, dims), lows)]
+    return columns, sums.astype(np.int64)
+
+
+def _cooccurrence(match_req, match_rule, label_req, label_code, n_requests):
+    # Every (matched rule, label) pair of the same request, without a Python loop over requests
+    label_count = np.bincount(label_req, minlength=n_requests)
+    label_start = np.cumsum(label_count) - label_count
+    reps = label_count[match_req]
+    total = int(reps.sum())
+    within = np.arange(total) - np.repeat(np.cumsum(reps) - reps, reps)
+    pair_label = label_code[np.repeat(label_start[match_req], reps) + within]
+    return np.repeat(match_req, reps), np.repeat(match_rule, reps), pair_label
+
+
+def _aggregate(columns, window_seconds):
+    acl, ts = columns["req_acl"], columns["req_ts"]
+    window = ts // (window_seconds * 1000)
+    match_req, match_rule = columns["match_req"], columns["match_rule"]
+    label_req, label_code = columns["label_req"], columns["label_code"]
+    terminated = columns["req_term"] >= 0
+    pair_req, pair_rule, pair_label = _cooccurrence(match_req, match_rule, label_req, label_code, len(acl))
+
+    return {
+        "requests": _group_sum([acl, window]),
+        "matches": _group_sum([acl[match_req], window[match_req], match_rule]),
+        "terminations": _group_sum([acl[terminated], window[terminated], columns["req_term"][terminated]]),
+        "labels": _group_sum([acl[label_req], window[label_req], label_code]),
+        "edges": _group_sum([acl[pair_req], window[pair_req], pair_rule, pair_label]),
+    }
+
+
+def _process_chunk(task):
+    path, start, end, window_seconds = task
+    vocabs, columns = _decode(_read_lines(path, start, end))
+    return vocabs, _aggregate(columns, window_seconds), len(columns["req_acl"])
+
+
+def _chunks(paths, window_seconds):
+    for path in paths:
+        if path.endswith(".gz"):
+            yield path, 0, None, window_seconds
+            continue
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), CHUNK_BYTES):
+            yield path, start, start + CHUNK_BYTES, window_seconds
+
+
+def _merge(partials):
+    # Re-code each chunk's vocabularies into global ones, then group the concatenated tables again
+    vocabs = {kind: {} for kind in VOCABS}
+    collected = {name: ([], []) for name in TABLES}
+    for chunk_vocabs, tables in partials:
+        remap = {
+            kind: np.array([vocabs[kind].setdefault(s, len(vocabs[kind])) for s in chunk_vocabs[kind]] or [0],
+                           dtype=np.int64)
+            for kind in VOCABS
+        }
+        for name, roles in TABLES.items():
+            keys, counts = tables[name]
+            collected[name][0].append([k if role == "window" else remap[role][k] for role, k in zip(roles, keys)])
+            collected[name][1].append(counts)
+
+    merged = {}
+    for name, roles in TABLES.items():
+        keys, counts = collected[name]
+        if not keys:
+            merged[name] = _group_sum([np.empty(0, dtype=np.int64) for _ in roles])
+            continue
+        columns = [np.concatenate([k[i] for k in keys]) for i in range(len(roles))]
+        merged[name] = _group_sum(columns, np.concatenate(counts).astype(np.float64))
+    return {kind: list(vocab) for kind, vocab in vocabs.items()}, merged
+
+
+def analyze_logs(paths, window_seconds=DEFAULT_WINDOW_SECONDS, jobs=None):
+    """Aggregate WAF log files. Returns (vocabularies, tables, lines read)."""
+    partials = []
+    lines = 0
+    tasks = list(_chunks(paths, window_seconds))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for vocabs, tables, n in pool.map(_process_chunk, tasks):
+            partials.append((vocabs, tables))
+            lines += n
+    vocabs, tables = _merge(partials)
+    return vocabs, tables, lines
+
+
+def traffic_path(traffic_dir, acl_arn):
+    # arn:aws:wafv2:<region>:<account>:<scope>/webacl/<name>/<id>
+    parts = acl_arn.split("/")
+    name = parts[-2] if len(parts) >= 3 else "webacl"
+    return os.path.join(traffic_dir, f"{name}_{hashlib.sha1(acl_arn.encode()).hexdigest()[:12]}.npz")
+
+
+def save_traffic(traffic_dir, vocabs, tables, window_seconds):
+    """Write one .npz per WebACL with its own compacted rule/label vocabularies."""
+    os.makedirs(traffic_dir, exist_ok=True)
+    written = []
+    for acl_code, acl_arn in enumerate(vocabs["acl"]):
+        if not acl_arn:
+            continue
+        selected = {}
+        for name, (keys, counts) in tables.items():
+            rows = keys[0] == acl_code
+            selected[name] = ([k[rows] for k in keys[1:]], counts[rows])
+
+        arrays = {"acl": np.array(acl_arn), "window_seconds": np.array(window_seconds)}
+        for kind in ("rule", "label"):
+            used = np.unique(np.concatenate([
+                keys[TABLES[name].index(kind) - 1]
+                for name, (keys, _) in selected.items() if kind in TABLES[name]
+            ]))
+            arrays[f"{kind}s"] = np.array([vocabs[kind][i] for i in used], dtype=str)
+            for name, (keys, _) in selected.items():
+                if kind in TABLES[name]:
+                    i = TABLES[name].index(kind) - 1
+                    keys[i] = np.searchsorted(used, keys[i])
+        for name, (keys, counts) in selected.items():
+            for role, column in zip(TABLES[name][1:], keys):
+                arrays[f"{name}_{role}"] = column
+            arrays[f"{name}_count"] = counts
+
+        path = traffic_path(traffic_dir, acl_arn)
+        tmp = f"{path}.tmp.npz"
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, path)
+        written.append(path)
+    return written
+
+
+_traffic_files = {}  # { path: (mtime_ns, arrays) }
+
+
+def load_traffic(traffic_dir, acl_arn):
+    # Aggregates of one WebACL, re-read only when the file changes; None if no logs were analyzed
+    if not acl_arn:
+        return None
+    path = traffic_path(traffic_dir, acl_arn)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _traffic_files.get(path)
+    if cached is None or cached[0] != mtime:
+        with np.load(path) as data:
+            cached = _traffic_files[path] = (mtime, {k: data[k] for k in data.files})
+    return cached[1]
+
+
+def stamp(traffic_dir, acl_arn):
+    # Changes whenever the WebACL's traffic file is rewritten
+    try:
+        return os.stat(traffic_path(traffic_dir, acl_arn)).st_mtime_ns if acl_arn else 0
+    except FileNotFoundError:
+        return 0
+
+
+def parse_time(value):
+    # Epoch seconds or ISO 8601; naive timestamps are UTC
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+def hit_counts(traffic, start=None, end=None):
+    """Totals over the windows in [start, end) (epoch seconds), keyed by rule / label key / (rule, label key)."""
+    window_seconds = int(traffic["window_seconds"])
+    rules = traffic["rules"].tolist()
+    # Labels are matched on their last segment, like the label graph
+    keys = [mapping.label_key(label) for label in traffic["labels"].tolist()]
+
+    def totals(name):
+        starts = traffic[f"{name}_window"] * window_seconds
+        rows = np.ones(len(starts), dtype=bool)
+        if start is not None:
+            rows &= starts + window_seconds > start
+        if end is not None:
+            rows &= starts < end
+        return {role: traffic[f"{name}_{role}"][rows] for role in TABLES[name][2:]}, traffic[f"{name}_count"][rows]
+
+    hits = {"requests": 0, "matches": {}, "terminations": {}, "labels": {}, "edges": {}, "range": None}
+    _, counts = totals("requests")
+    hits["requests"] = int(counts.sum())
+    windows = traffic["requests_window"]
+    if len(windows):
+        hits["range"] = (int(windows.min()) * window_seconds, (int(windows.max()) + 1) * window_seconds)
+
+    for name in ("matches", "terminations"):
+        columns, counts = totals(name)
+        sums = np.bincount(columns["rule"], weights=counts, minlength=len(rules))
+        hits[name] = {rules[i]: int(sums[i]) for i in np.flatnonzero(sums)}
+    columns, counts = totals("labels")
+    sums = np.bincount(columns["label"], weights=counts, minlength=len(keys))
+    for i in np.flatnonzero(sums):
+        hits["labels"][keys[i]] = hits["labels"].get(keys[i], 0) + int(sums[i])
+    columns, counts = totals("edges")
+    pairs, sums = _group_sum([columns["rule"], columns["label"]], counts.astype(np.float64))
+    for rule, label, n in zip(*pairs, sums):
+        key = (rules[rule], keys[label])
+        hits["edges"][key] = hits["edges"].get(key, 0) + int(n)
+    return hits
+
+
+def log_rule_id(rule):
+    # How a graph rule shows up in the logs (see the module comment)
+    if rule is None:
+        return None
+    if rule.get("RuleGroup"):
+        return f"{rule['RuleGroup']['ARN']}#{rule['RuleGroup']['Rule']}"
+    statement = rule.get("Statement", {})
+    if "ManagedRuleGroupStatement" in statement:
+        managed = statement["ManagedRuleGroupStatement"]
+        return f"{managed.get('VendorName')}#{managed.get('Name')}"
+    if "RuleGroupReferenceStatement" in statement:
+        return statement["RuleGroupReferenceStatement"].get("ARN")
+    return rule.get("Name")
+
+
+def _rule_hits(name, hits, rules):
+    return hits["matches"].get(log_rule_id(rules.get(name)), 0)
+
+
+def _pair_hits(rule_name, label_node, hits, rules):
+    label = mapping.label_key(label_node[len("Label:"):])
+    return hits["edges"].get((log_rule_id(rules.get(rule_name)), label), 0)
+
+
+def edge_hits(source, edge_label, target, hits, rules):
+    # Graph edges are named by node text: rule -->|produces| Label:x -->|consume| rule -->|action| Block
+    if edge_label == "produces":
+        return _pair_hits(source, target, hits, rules)
+    if edge_label == "consume":
+        return _pair_hits(target, source, hits, rules)
+    return _rule_hits(source, hits, rules)
+
+
+def node_title(label, hits, rules):
+    if label.startswith("Label:"):
+        return f"on {hits['labels'].get(mapping.label_key(label[len('Label:'):]), 0):,} requests"
+    if rules.get(label) is not None:
+        return f"{_rule_hits(label, hits, rules):,} matches, {hits['terminations'].get(label, 0):,} terminating"
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate AWS WAF logs into per-WebACL hit counts")
+    parser.add_argument("logs", nargs="+", help="JSONL or .gz log files, or globs")
+    parser.add_argument("--out", default=os.path.join("uploads", "traffic"))
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW_SECONDS, help="window size in seconds")
+    parser.add_argument("--jobs", type=int, help="worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    paths = [p for pattern in args.logs for p in sorted(glob.glob(pattern, recursive=True))]
+    started = datetime.now()
+    vocabs, tables, lines = analyze_logs(paths, args.window, args.jobs)
+    written = save_traffic(args.out, vocabs, tables, args.window)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"{lines:,} log lines from {len(paths)} files in {elapsed:.1f}s -> {len(written)} WebACLs")
+    for path in written:
+        print(f"  {path}")
@@ -1,14 +1,11 @@
 import json
 import re
 import os
+import threading
+from collections import OrderedDict, deque
+from collections.abc import Mapping
 
-# Load AWS-managed rules label mapping
-managed_label_map_path = os.path.join("aws-managedrules-labels.json")
-if os.path.exists(managed_label_map_path):
-    with open(managed_label_map_path) as f:
-        MANAGED_LABEL = json.load(f)
-else:
-    MANAGED_LABEL = {}
+import catalog
 
 def get_children(label, items):
     return [item for item in items if item != label and item.startswith(label + ":")]
@@ -65,6 +62,112 @@ def main(waf_config,mmd_path):
                 f.write(f"    {label} -->|consumed by| {consumer}[\"{consumer}\"] -->|action|{action}\n")
             f.write("  end\n\n")
 
+def managed_labels(managed):
+    # Labels for a ManagedRuleGroupStatement, from the managed rule catalog
+    vendor = managed.get("VendorName", "")
+    group = managed.get("Name", "")
+    version = managed.get("Version")
+    prefix = f"awswaf:managed:{vendor.lower()}:*"
+
+    # Add overrides if present, otherwise everything the catalog knows about the group
+    overrides = managed.get("RuleActionOverrides", [])
+    if overrides:
+        return [f"{prefix}:{o['Name']}" for o in overrides if o.get("Name")]
+    entry = catalog.lookup(vendor, group, version)
+    if not entry:
+        return []
+    if entry["labels"]:
+        return list(entry["labels"])
+    return [f"{prefix}:{rule}" for rule in entry["rules"]]
+
+
+def produced_labels(rule):
+    # Explicit RuleLabels first, then simulated labels from managed rules
+    produces = [lbl["Name"] for lbl in rule.get("RuleLabels", [])]
+    managed = rule.get("Statement", {}).get("ManagedRuleGroupStatement")
+    if managed:
+        produces.extend(managed_labels(managed))
+    return produces
+
+
+def label_matches(statement):
+    # Every LabelMatchStatement in the statement, nested ones included
+    matches = []
+
+    def collect_matches(stmt):
+        if isinstance(stmt, dict):
+            if "LabelMatchStatement" in stmt:
+                matches.append(stmt["LabelMatchStatement"])
+            for v in stmt.values():
+                collect_matches(v)
+        elif isinstance(stmt, list):
+            for item in stmt:
+                collect_matches(item)
+
+    collect_matches(statement)
+    return matches
+
+
+def consumed_labels(statement):
+    return [match["Key"] for match in label_matches(statement)]
+
+
+def label_key(label):
+    # Labels are matched on their last segment, so "awswaf:managed:aws:*:X" matches "...:core-rule-set:X"
+    return label.split(":")[-1]
+
+
+def match_key(match):
+    # Index key of a LabelMatchStatement: the label, or for NAMESPACE scope the namespace ending in ":"
+    # (label names can't end with a colon, so the two never collide)
+    if match.get("Scope") == "NAMESPACE":
+        return match["Key"].rstrip(":") + ":"
+    return match["Key"]
+
+
+def is_namespace_key(key):
+    return key.endswith(":")
+
+
+def namespace_index(labels):
+    """Labels by the namespaces they sit under, for NAMESPACE matches: (runs, prefixes).
+
+    Either side may be fully qualified ("awswaf:<account>:webacl:<name>:..."), so a namespace matches
+    any run of segments of a label's namespace (runs), or ends with the start of it (prefixes).
+    """
+    runs = {}
+    prefixes = {}
+    for label in labels:
+        parts = tuple(label.split(":")[:-1])
+        for i in range(len(parts)):
+            prefixes.setdefault(parts[:i + 1], []).append(label)
+            for j in range(i + 1, len(parts) + 1):
+                runs.setdefault(parts[i:j], []).append(label)
+    return runs, prefixes
+
+
+def _with_wildcards(segments):
+    # The segments as given, and with one of them replaced by the "*" standing for the rule group in
+    # simulated managed labels (never all of them)
+    yield segments
+    if len(segments) > 1:
+        for i in range(len(segments)):
+            yield segments[:i] + ("*",) + segments[i + 1:]
+
+
+def namespace_labels(index, namespace):
+    # Labels of a namespace_index under a NAMESPACE-scoped key
+    runs, prefixes = index
+    wanted = tuple(namespace.rstrip(":").split(":"))
+    found = {}
+    for key in _with_wildcards(wanted):
+        found.update(dict.fromkeys(runs.get(key, ())))
+    for size in range(1, len(wanted)):
+        for key in _with_wildcards(wanted[-size:]):
+            found.update(dict.fromkeys(prefixes.get(key, ())))
+    return list(found)
+
+
 def find_label_relationships(rules):
     label_producers = {}
     label_consumers = {}
@@ -72,134 +175,150 @@ def find_label_relationships(rules):
     for rule in rules:
         name = rule["Name"]
 
-        # 1. RuleLabels (manual labels)
-        for label in rule.get("RuleLabels", []):
-            label_name = label["Name"]
-            label_producers.setdefault(label_name, []).append(name)
-
-        # 2. ManagedRuleGroup labels
-        statement = rule.get("Statement", {})
-        managed = statement.get("ManagedRuleGroupStatement")
-        if managed:
-            vendor = managed.get("VendorName", "").lower()
-            group = managed.get("Name")
-            overrides = managed.get("RuleActionOverrides")
-
-            if overrides is not None:
-                for override in overrides:
-                    rule_name = override.get("Name")
-                    if rule_name:
-                        label = f"awswaf:managed:{vendor}:*:{rule_name}"
-                        label_producers.setdefault(label, []).append(name)
-            else:
-                # No overrides — check static label map
-                managed_labels = MANAGED_LABEL.get(group)
-                if managed_labels:
-                    for rule_name in managed_labels:
-                        label = f"awswaf:managed:{vendor}:*:{rule_name}"
-                        label_producers.setdefault(label, []).append(name)
-
-        # 3. Consumers via LabelMatchStatement
-        def search_labels(stmt):
-            if isinstance(stmt, dict):
-                if "LabelMatchStatement" in stmt:
-                    key = stmt["LabelMatchStatement"]["Key"]
-                    label_consumers.setdefault(key, []).append(name)
-                for v in stmt.values():
-                    search_labels(v)
-            elif isinstance(stmt, list):
-                for item in stmt:
-                    search_labels(item)
-
-        search_labels(statement)
+        # 1. RuleLabels (manual labels) and ManagedRuleGroup labels
+        for label in produced_labels(rule):
+            label_producers.setdefault(label, []).append(name)
+
+        # 2. Consumers via LabelMatchStatement (NAMESPACE matches keyed "<namespace>:")
+        for match in label_matches(rule.get("Statement", {})):
+            label_consumers.setdefault(match_key(match), []).append(name)
 
     return label_producers, label_consumers
 
 
-def build_relationship(rule_name, rules, producers, consumers, visited=None):
-    if visited is None:
-        visited = set()
+# Indexed rule groups, keyed by (ARN, LockToken, overrides) so a group shared by many ACLs is prepared once.
+# Bounded, since every re-fetched version of a group gets a new LockToken
+RULE_GROUP_CACHE_MAX_ENTRIES = 1024
+_rule_group_cache = OrderedDict()  # least recently used first
+_rule_group_cache_lock = threading.Lock()
+
+
+def _prepare_rule_group(ref, group):
+    cache_key = (
+        ref["ARN"],
+        group.get("LockToken"),
+        json.dumps([ref.get("ExcludedRules"), ref.get("RuleActionOverrides")], sort_keys=True),
+    )
+    with _rule_group_cache_lock:
+        if cache_key in _rule_group_cache:
+            _rule_group_cache.move_to_end(cache_key)
+            return _rule_group_cache[cache_key]
+
+    # ExcludedRules run in Count mode; RuleActionOverrides replace the action outright
+    overrides = {r["Name"]: {"Count": {}} for r in ref.get("ExcludedRules", []) if r.get("Name")}
+    for override in ref.get("RuleActionOverrides", []):
+        if override.get("Name") and override.get("ActionToUse"):
+            overrides[override["Name"]] = override["ActionToUse"]
+
+    inner = []
+    for rule in sorted(group.get("Rules", []), key=lambda r: r.get("Priority", 0)):
+        rule = dict(rule)
+        if rule["Name"] in overrides:
+            rule["Action"] = overrides[rule["Name"]]
+        inner.append(rule)
+    with _rule_group_cache_lock:
+        _rule_group_cache[cache_key] = inner
+        if len(_rule_group_cache) > RULE_GROUP_CACHE_MAX_ENTRIES:
+            _rule_group_cache.popitem(last=False)
+    return inner
+
+
+def inline_rule_group(rule, group):
+    # The group's rules, renamed "<referencing rule>.<rule>" (WAF names can't contain dots)
+    # and ordered between this rule and the next one
+    ref = rule["Statement"]["RuleGroupReferenceStatement"]
+    inner = _prepare_rule_group(ref, group)
+    count_only = "Count" in (rule.get("OverrideAction") or {})
+    priority = rule.get("Priority", 0)
+
+    inlined = []
+    for i, inner_rule in enumerate(inner):
+        inner_rule = dict(inner_rule)
+        inner_rule["RuleGroup"] = {"Name": group.get("Name"), "ARN": ref["ARN"], "Rule": inner_rule["Name"]}
+        inner_rule["Name"] = f"{rule['Name']}.{inner_rule['Name']}"
+        inner_rule["Priority"] = priority + (i + 1) / (len(inner) + 1)
+        if count_only and next(iter(inner_rule.get("Action") or {}), None) in ("Allow", "Block"):
+            inner_rule["Action"] = {"Count": {}}
+        inlined.append(inner_rule)
+    return inlined
+
+
+def expand_rule_groups(rules, rule_groups):
+    # rule_groups: { arn: RuleGroup } as returned by get_rule_group (plus its LockToken)
+    expanded = []
+    for rule in rules:
+        expanded.append(rule)
+        ref = rule.get("Statement", {}).get("RuleGroupReferenceStatement")
+        if ref and ref.get("ARN") in rule_groups:
+            expanded.extend(inline_rule_group(rule, rule_groups[ref["ARN"]]))
+    return expanded
+
+
+def get_rule(rules, rule_name):
+    # rules is either the WebACL rule list or a name -> rule mapping (e.g. a snapshot)
+    if isinstance(rules, Mapping):
+        return rules.get(rule_name)
+    return next((r for r in rules if r["Name"] == rule_name), None)
+
+
+def runs_before(first, second, priorities):
+    # A label is only visible to rules evaluated after the rule that adds it
+    if priorities is None or first not in priorities or second not in priorities:
+        return True
+    return priorities[first] < priorities[second]
+
+
+def build_relationship(rule_name, rules, producers, consumers, visited=None, priorities=None):
+    """Nested {produce, consume, action} tree of a rule's label graph, as served by /api.
+
+    Built breadth-first without recursion, expanding each rule once: later references to a rule
+    are {}, like references back to a rule on the current path (expanding every path is exponential).
+    """
+    consumers_of, producers_of = label_lookups(producers, consumers)
+    visited = set(visited or ())
     if rule_name in visited:
         return {}
     visited.add(rule_name)
 
-    result = {
-        "produce": {},
-        "consume": {},
-        "action": None
-    }
-
-    rule_def = next((r for r in rules if r["Name"] == rule_name), None)
-    if not rule_def:
-        return result
+    def action_of(rule_def):
+        return next(iter(rule_def.get("Action") or {}), None)
+
+    def child(name):
+        # The node a related rule is expanded into, or {} when it is expanded elsewhere
+        if name in visited:
+            return {}
+        visited.add(name)
+        node = {}
+        queue.append((name, node))
+        return node
+
+    root = {}
+    queue = deque([(rule_name, root)])
+    while queue:
+        name, result = queue.popleft()
+        result.update({"produce": {}, "consume": {}, "action": None})
+        rule_def = get_rule(rules, name)
+        if not rule_def:
+            continue
+        result["action"] = action_of(rule_def)
 
-    action_key = list(rule_def.get("Action", {}).keys())[0] if rule_def.get("Action") else None
-    result["action"] = action_key
+        # Build produce relationships
+        for label in produced_labels(rule_def):
+            result["produce"][label] = [
+                {rel_rule: child(rel_rule)}
+                for rel_rule in consumers_of(label)
+                if runs_before(name, rel_rule, priorities)
+            ]
 
-    # Start with explicit RuleLabels
-    produces = [lbl["Name"] for lbl in rule_def.get("RuleLabels", [])]
+        # Build consume relationships
+        for match in label_matches(rule_def.get("Statement", {})):
+            result["consume"][match["Key"]] = [
+                {rel_rule: child(rel_rule), "action": action_of(get_rule(rules, rel_rule) or {})}
+                for rel_rule in producers_of(match_key(match))
+                if runs_before(rel_rule, name, priorities)
+            ]
 
-    # Add simulated labels from managed rules
-    statement = rule_def.get("Statement", {})
-    managed = statement.get("ManagedRuleGroupStatement")
-    if managed:
-        vendor = managed.get("VendorName", "").lower()
-        group = managed.get("Name", "")
-
-        # Add overrides if present
-        overrides = managed.get("RuleActionOverrides", [])
-        if overrides:
-            for override in overrides:
-                rule = override.get("Name")
-                if vendor and rule:
-                    simulated_label = f"awswaf:managed:{vendor}:*:{rule}"
-                    produces.append(simulated_label)
-        else:
-            rule_names = MANAGED_LABEL.get(group, [])
-            for rule in rule_names:
-                simulated_label = f"awswaf:managed:{vendor}:*:{rule}"
-                produces.append(simulated_label)
- 
-    # Collect consumed labels
-    consumes = []
-
-    def collect_consumes(stmt):
-        if isinstance(stmt, dict):
-            if "LabelMatchStatement" in stmt:
-                key = stmt["LabelMatchStatement"]["Key"]
-                consumes.append(key)
-            for v in stmt.values():
-                collect_consumes(v)
-        elif isinstance(stmt, list):
-            for item in stmt:
-                collect_consumes(item)
-
-    collect_consumes(statement)
-
-    # Build produce relationships
-    for label in produces:
-        result["produce"][label] = []
-        for lbl_key, rel_rules in consumers.items():
-            if lbl_key.split(":")[-1] == label.split(":")[-1]:
-                for rel_rule in rel_rules:
-                    sub_map = build_relationship(rel_rule, rules, producers, consumers, visited.copy())
-                    result["produce"][label].append({rel_rule: sub_map})
-
-    # Build consume relationships
-    for label in consumes:
-        result["consume"][label] = []
-        for lbl_key, rel_rules in producers.items():
-            if lbl_key.split(":")[-1] == label.split(":")[-1]:
-                for rel_rule in rel_rules:
-                    sub_map = build_relationship(rel_rule, rules, producers, consumers, visited.copy())
-                    rel_rule_def = next((r for r in rules if r["Name"] == rel_rule), {})
-                    rel_action = list(rel_rule_def.get("Action", {}).keys())[0] if rel_rule_def.get("Action") else None
-                    result["consume"][label].append({
-                        rel_rule: sub_map,
-                        "action": rel_action
-                    })
-
-    return result
+    return root
 
 
 def generate_mermaid_from_relationship(relationship, root_rule_name=None):
@@ -408,4 +527,104 @@ def mermaid_to_vis(mermaid_text):
                 "label": edge_label.strip()
             })
 
-    return {"nodes": nodes, "edges": edges}
\ No newline at end of file
+    return {"nodes": nodes, "edges": edges}
+
+def _by_label_key(index):
+    by_key = {}
+    for label, names in index.items():
+        by_key.setdefault(label_key(label), []).extend(names)
+    return by_key
+
+
+def label_lookups(producers, consumers):
+    """(consumers_of(label), producers_of(key)) over find_label_relationships' indexes.
+
+    consumers_of gives the rules matching a produced label, by label or by NAMESPACE; producers_of
+    the rules adding what a consumer key (see match_key) looks for. NAMESPACE keys are resolved
+    once, through namespace_index, rather than compared with every label.
+    """
+    producers_by_key = _by_label_key(producers)
+    consumers_by_key = _by_label_key({k: v for k, v in consumers.items() if not is_namespace_key(k)})
+    produced = namespace_index(producers)
+    namespace_consumers = {}
+    namespace_producers = {}
+    for key, names in consumers.items():
+        if is_namespace_key(key):
+            labels = namespace_labels(produced, key)
+            namespace_producers[key] = [name for label in labels for name in producers[label]]
+            for label in labels:
+                namespace_consumers.setdefault(label, []).extend(names)
+
+    def consumers_of(label):
+        return list(dict.fromkeys(consumers_by_key.get(label_key(label), []) + namespace_consumers.get(label, [])))
+
+    def producers_of(key):
+        if is_namespace_key(key):
+            return list(dict.fromkeys(namespace_producers.get(key, [])))
+        return producers_by_key.get(label_key(key), [])
+
+    return consumers_of, producers_of
+
+
+def iter_relationship_edges(rule_name, rules, producers, consumers, priorities=None):
+    """Edges of a rule's label graph as (source, edge label, target), yielded as they are found.
+
+    Walks breadth-first from rule_name and expands each rule once, so nothing is buffered beyond the
+    rules visited and the edges already emitted (for de-duplication).
+    """
+    consumers_of, producers_of = label_lookups(producers, consumers)
+    visited = {rule_name}
+    queue = deque([rule_name])
+    emitted = set()
+
+    while queue:
+        name = queue.popleft()
+        rule_def = get_rule(rules, name)
+        if not rule_def:
+            continue
+
+        edges = []
+        action = next(iter(rule_def.get("Action") or {}), None)
+        if action:
+            edges.append((name, "action", action))
+
+        # Downstream: the labels this rule adds and the later rules matching them
+        for label in produced_labels(rule_def):
+            label_node = f"Label:{label}"
+            edges.append((name, "produces", label_node))
+            for consumer in consumers_of(label):
+                if consumer == name or not runs_before(name, consumer, priorities):
+                    continue
+                edges.append((label_node, "consume", consumer))
+                if consumer not in visited:
+                    visited.add(consumer)
+                    queue.append(consumer)
+
+        # Upstream: earlier rules adding the labels this rule matches; they emit the edges to it
+        for match in label_matches(rule_def.get("Statement", {})):
+            for producer in producers_of(match_key(match)):
+                if producer not in visited and runs_before(producer, name, priorities):
+                    visited.add(producer)
+                    queue.append(producer)
+
+        for edge in edges:
+            if edge not in emitted:
+                emitted.add(edge)
+                yield edge
+
+
+def iter_mermaid(edges):
+    yield "graph TD"
+    for source, label, target in edges:
+        yield f"    {source} -->|{label}| {target}"
+
+
+def iter_vis_records(edges):
+    # {"node": {...}} the first time a node is seen, then {"edge": {...}}, in vis.js form
+    node_ids = {}
+    for source, label, target in edges:
+        for node in (source, target):
+            if node not in node_ids:
+                node_ids[node] = len(node_ids)
+                yield {"node": {"id": node_ids[node], "label": node}}
+        yield {"edge": {"from": node_ids[source], "to": node_ids[target], "label": label}}
@@ -0,0 +1,159 @@
+import bisect
+import hashlib
+import json
+
+import mapping
+
+# Actions that stop evaluation of the rest of the WebACL when the rule matches.
+# Captcha/Challenge only terminate for some requests, so they never shadow anything.
+TERMINATING_ACTIONS = {"Allow", "Block"}
+
+
+def rule_priority(rule):
+    return rule.get("Priority", 0)
+
+
+def sort_by_priority(rules):
+    return sorted(rules, key=rule_priority)
+
+
+def statement_hash(stmt):
+    return hashlib.sha1(json.dumps(stmt, sort_keys=True).encode("utf-8")).digest()
+
+
+def _action(rule):
+    return next(iter(rule.get("Action") or {}), None)
+
+
+def _covers(stmt):
+    # Conditions that make this statement match: itself, or any branch of an OrStatement
+    keys = [statement_hash(stmt)]
+    for sub in stmt.get("OrStatement", {}).get("Statements", []):
+        keys.append(statement_hash(sub))
+    return keys
+
+
+def _implies(stmt):
+    # Conditions that hold whenever this statement matches: itself, or every branch of an AndStatement
+    keys = [statement_hash(stmt)]
+    for sub in stmt.get("AndStatement", {}).get("Statements", []):
+        keys.append(statement_hash(sub))
+    return keys
+
+
+def _can_shadow(rule):
+    stmt = rule.get("Statement", {})
+    return (
+        _action(rule) in TERMINATING_ACTIONS
+        and "RateBasedStatement" not in stmt
+        and "ManagedRuleGroupStatement" not in stmt
+        and "RuleGroupReferenceStatement" not in stmt
+    )
+
+
+def _is_namespace(match):
+    return match.get("Scope") == "NAMESPACE"
+
+
+def analyze_rule_order(rules):
+    ordered = sort_by_priority(rules)
+
+    # Label key -> sorted evaluation positions of the rules producing it; NAMESPACE matches are
+    # resolved through an index of the produced labels by namespace
+    producer_pos = {}
+    produced = {}  # label -> evaluation positions
+    consumer_keys = set()
+    namespaces = set()
+    explicit_labels = {}  # label key -> (label, [rule names]) for RuleLabels only
+
+    for pos, rule in enumerate(ordered):
+        for label in mapping.produced_labels(rule):
+            producer_pos.setdefault(mapping.label_key(label), []).append(pos)
+            produced.setdefault(label, []).append(pos)
+        for lbl in rule.get("RuleLabels", []):
+            entry = explicit_labels.setdefault(mapping.label_key(lbl["Name"]), (lbl["Name"], []))
+            entry[1].append(rule["Name"])
+        for match in mapping.label_matches(rule.get("Statement", {})):
+            if _is_namespace(match):
+                namespaces.add(match["Key"])
+            else:
+                consumer_keys.add(mapping.label_key(match["Key"]))
+
+    # Each namespace is resolved once through the segment index, not compared with every label
+    produced_index = mapping.namespace_index(produced)
+    namespace_members = {namespace: mapping.namespace_labels(produced_index, namespace) for namespace in namespaces}
+    namespace_pos = {
+        namespace: sorted({pos for label in labels for pos in produced[label]})
+        for namespace, labels in namespace_members.items()
+    }
+    namespaced = {label for labels in namespace_members.values() for label in labels}
+
+    def producers_of(match):
+        # Ascending evaluation positions of the rules adding what the match looks for
+        if _is_namespace(match):
+            return namespace_pos[match["Key"]]
+        return producer_pos.get(mapping.label_key(match["Key"]), [])
+
+    # Consumers placed before (some of) their producers
+    misordered = []
+    effective_edges = 0
+    for pos, rule in enumerate(ordered):
+        matches = {(m.get("Scope"), m["Key"]): m for m in mapping.label_matches(rule.get("Statement", {}))}
+        for match in matches.values():
+            positions = producers_of(match)
+            if not positions:
+                continue
+            # positions is ascending, so everything left of the cut runs before this rule
+            cut = bisect.bisect_left(positions, pos)
+            effective_edges += cut
+            if cut < len(positions):
+                late = [ordered[p]["Name"] for p in positions[cut:] if p != pos]
+                if not late:
+                    continue
+                misordered.append({
+                    "rule": rule["Name"],
+                    "priority": rule_priority(rule),
+                    "label": match["Key"],
+                    "late_producers": late,
+                    "unreachable": cut == 0,
+                })
+
+    # Rules that can never match because an earlier terminating rule always matches first
+    shadowed = []
+    seen = {}  # condition hash -> earlier terminating rule
+    for pos, rule in enumerate(ordered):
+        stmt = rule.get("Statement", {})
+        if stmt and "ManagedRuleGroupStatement" not in stmt and "RuleGroupReferenceStatement" not in stmt:
+            shadower = next((seen[k] for k in _implies(stmt) if k in seen), None)
+            if shadower is not None:
+                shadowed.append({
+                    "rule": rule["Name"],
+                    "priority": rule_priority(rule),
+                    "shadowed_by": shadower["Name"],
+                    "shadowed_by_priority": rule_priority(shadower),
+                    "action": _action(shadower),
+                })
+        # A label match only means the same thing at every later position once all producers of the
+        # label have run: before that, this rule sees fewer labels than the rules after it
+        settled = all(
+            positions and positions[-1] < pos
+            for positions in map(producers_of, mapping.label_matches(stmt))
+        )
+        if stmt and settled and _can_shadow(rule):
+            for k in _covers(stmt):
+                seen.setdefault(k, rule)
+
+    # Explicit labels that no rule ever matches on
+    unused_labels = [
+        {"label": label, "producers": names}
+        for key, (label, names) in explicit_labels.items()
+        if key not in consumer_keys and label not in namespaced
+    ]
+
+    return {
+        "rules": ordered,
+        "misordered": misordered,
+        "shadowed": shadowed,
+        "unused_labels": unused_labels,
+        "effective_edges": effective_edges,
+    }
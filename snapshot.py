@@ -0,0 +1,416 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from collections.abc import Mapping
+
+import catalog
+import mapping
+
+# Binary snapshot of a WebACL index.
+#
+# Layout (little endian):
+#   header   : magic, format version, section count, source mtime_ns, source size, catalog stamp
+#   sections : table of (tag, offset, length) followed by the section payloads
+#
+#   STRS  string table      u32 count, u32 offsets[count + 1], utf-8 bytes
+#   RULE  rule table        u32 count, (name, f64 priority, action, blob_off, blob_len) per rule
+#   RIDX  rule name index   u32 rule indices sorted by rule name
+#   PROD  label producers   u32 count, (label, start, count) sorted by label, u32 rule indices
+#   CONS  label consumers   same layout as PROD
+#   REFS  reference map     u32 count, (arn, kind, start, count) sorted by arn, u32 rule indices
+#   META  WebACL fields other than Rules, as JSON
+#   BLOB  rule definitions, as JSON
+#
+# Readers mmap the file and resolve lookups directly from the mapped pages,
+# so workers share the page cache and nothing is parsed up front.
+
+MAGIC = b"WAFSNAP\x00"
+VERSION = 4
+
+HEADER = struct.Struct("<8sHHqQq")
+SECTION = struct.Struct("<4sQQ")
+U32 = struct.Struct("<I")
+# Priority is a double so inlined rule group rules can sit between two WebACL rules
+RULE_ENTRY = struct.Struct("<IdIII")
+ADJ_ENTRY = struct.Struct("<III")
+REF_ENTRY = struct.Struct("<IIII")
+
+REF_KINDS = {
+    "IPSetReferenceStatement": "ipset",
+    "RegexPatternSetReferenceStatement": "regex",
+    "RuleGroupReferenceStatement": "rulegroup",
+}
+
+
+# Files in the upload folder that are not WebACL exports
+NON_ACL_PREFIXES = ("IPSet_", "RegexPatternSet_", "ipset_refs", "regexpattern_refs", "rulegroup_refs")
+RULE_GROUP_PREFIX = "RuleGroup_"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_path(snapshot_dir, file_id):
+    return os.path.join(snapshot_dir, f"{file_id}.snap")
+
+
+def _collect_refs(statement, found):
+    if isinstance(statement, dict):
+        for key, kind in REF_KINDS.items():
+            if key in statement and "ARN" in statement[key]:
+                found.add((statement[key]["ARN"], kind))
+        for v in statement.values():
+            _collect_refs(v, found)
+    elif isinstance(statement, list):
+        for item in statement:
+            _collect_refs(item, found)
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+
+    def add(self, value):
+        value = "" if value is None else str(value)
+        if value not in self.ids:
+            self.ids[value] = len(self.values)
+            self.values.append(value)
+        return self.ids[value]
+
+    def pack(self):
+        encoded = [v.encode("utf-8") for v in self.values]
+        offsets = [0]
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        head = struct.pack(f"<I{len(offsets)}I", len(encoded), *offsets)
+        return head + b"".join(encoded)
+
+
+def _pack_adjacency(strings, adjacency, rule_index):
+    entries = []
+    indices = []
+    for label in sorted(adjacency):
+        start = len(indices)
+        indices.extend(rule_index[name] for name in adjacency[label] if name in rule_index)
+        entries.append(ADJ_ENTRY.pack(strings.add(label), start, len(indices) - start))
+    return U32.pack(len(entries)) + b"".join(entries) + struct.pack(f"<{len(indices)}I", *indices)
+
+
+def _pack_refs(strings, refs):
+    entries = []
+    indices = []
+    for (arn, kind) in sorted(refs):
+        start = len(indices)
+        indices.extend(refs[(arn, kind)])
+        entries.append(REF_ENTRY.pack(strings.add(arn), strings.add(kind), start, len(indices) - start))
+    return U32.pack(len(entries)) + b"".join(entries) + struct.pack(f"<{len(indices)}I", *indices)
+
+
+def _referenced_rule_groups(rules, rule_groups):
+    # { arn: LockToken } of the rule groups that were inlined
+    refs = {}
+    for rule in rules:
+        arn = rule.get("Statement", {}).get("RuleGroupReferenceStatement", {}).get("ARN")
+        if arn in rule_groups:
+            refs[arn] = rule_groups[arn].get("LockToken")
+    return refs
+
+
+def build_snapshot(acl, dest, source_stat=None, rule_groups=None):
+    rule_groups = rule_groups or {}
+    rules = mapping.expand_rule_groups(acl.get("Rules", []), rule_groups)
+    strings = _StringTable()
+    rule_index = {}
+    rule_entries = []
+    blob = bytearray()
+    refs = {}
+
+    for i, rule in enumerate(rules):
+        name = rule["Name"]
+        rule_index[name] = i
+        action = next(iter(rule.get("Action") or rule.get("OverrideAction") or {}), "")
+        data = json.dumps(rule, separators=(",", ":")).encode("utf-8")
+        rule_entries.append(RULE_ENTRY.pack(
+            strings.add(name), float(rule.get("Priority", 0)), strings.add(action), len(blob), len(data)
+        ))
+        blob += data
+
+        found = set()
+        _collect_refs(rule.get("Statement", {}), found)
+        for key in found:
+            refs.setdefault(key, []).append(i)
+
+    # Managed rule group labels come from the catalog, so record which catalog they were built from
+    catalog_stamp = catalog.stamp()
+    producers, consumers = mapping.find_label_relationships(rules)
+    name_order = sorted(range(len(rules)), key=lambda i: rules[i]["Name"])
+    meta = {k: v for k, v in acl.items() if k != "Rules"}
+    meta["InlinedRuleGroups"] = _referenced_rule_groups(acl.get("Rules", []), rule_groups)
+
+    sections = [
+        (b"RULE", U32.pack(len(rule_entries)) + b"".join(rule_entries)),
+        (b"RIDX", struct.pack(f"<{len(name_order)}I", *name_order)),
+        (b"PROD", _pack_adjacency(strings, producers, rule_index)),
+        (b"CONS", _pack_adjacency(strings, consumers, rule_index)),
+        (b"REFS", _pack_refs(strings, refs)),
+        (b"META", json.dumps(meta, default=str).encode("utf-8")),
+        (b"BLOB", bytes(blob)),
+    ]
+    # Strings are interned while packing the other sections, so pack them last
+    sections.insert(0, (b"STRS", strings.pack()))
+
+    mtime_ns, size = (source_stat.st_mtime_ns, source_stat.st_size) if source_stat else (0, 0)
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for tag, payload in sections:
+        table.append(SECTION.pack(tag, offset, len(payload)))
+        offset += len(payload)
+
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+    # Write to a temp file and swap it in, so readers holding the old mapping keep a valid file
+    # (unique per call, since several threads may build the same snapshot at once)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest) or ".", prefix=os.path.basename(dest) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(sections), mtime_ns, size, catalog_stamp))
+            f.write(b"".join(table))
+            for _, payload in sections:
+                f.write(payload)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return dest
+
+
+def ingest(source, dest, rule_groups=None):
+    with open(source) as f:
+        acl = json.load(f)
+    return build_snapshot(acl, dest, os.stat(source), rule_groups)
+
+
+_rule_group_files = {}  # { path: (mtime_ns, RuleGroup) }
+
+
+def load_rule_groups(upload_dir):
+    # { arn: RuleGroup } for every RuleGroup_*.json in the upload folder, re-read only when a file changes
+    groups = {}
+    for name in os.listdir(upload_dir):
+        if not (name.startswith(RULE_GROUP_PREFIX) and name.endswith(".json")):
+            continue
+        path = os.path.join(upload_dir, name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = _rule_group_files.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path) as f:
+                cached = _rule_group_files[path] = (mtime, json.load(f))
+        group = cached[1]
+        if group.get("ARN"):
+            groups[group["ARN"]] = group
+    return groups
+
+
+class _Adjacency(Mapping):
+    """Read-only label -> [rule names] view over a PROD/CONS section."""
+
+    def __init__(self, snap, tag):
+        self._snap = snap
+        self._base, _ = snap._sections[tag]
+        self._count = U32.unpack_from(snap._buf, self._base)[0]
+        self._entries = self._base + U32.size
+        self._indices = self._entries + ADJ_ENTRY.size * self._count
+
+    def _entry(self, i):
+        return ADJ_ENTRY.unpack_from(self._snap._buf, self._entries + ADJ_ENTRY.size * i)
+
+    def _rules(self, start, count):
+        snap = self._snap
+        idx = struct.unpack_from(f"<{count}I", snap._buf, self._indices + U32.size * start)
+        return [snap._rule_name(i) for i in idx]
+
+    def __getitem__(self, label):
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sid, start, count = self._entry(mid)
+            key = self._snap._str(sid)
+            if key == label:
+                return self._rules(start, count)
+            if key < label:
+                lo = mid + 1
+            else:
+                hi = mid
+        raise KeyError(label)
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._snap._str(self._entry(i)[0])
+
+    def __len__(self):
+        return self._count
+
+    def items(self):
+        for i in range(self._count):
+            sid, start, count = self._entry(i)
+            yield self._snap._str(sid), self._rules(start, count)
+
+
+class _RuleTable(Mapping):
+    """Read-only rule name -> rule definition view, in WebACL order."""
+
+    def __init__(self, snap):
+        self._snap = snap
+
+    def __getitem__(self, name):
+        i = self._snap._find_rule(name)
+        if i is None:
+            raise KeyError(name)
+        return self._snap._rule(i)
+
+    def __iter__(self):
+        for i in range(self._snap._rule_count):
+            yield self._snap._rule_name(i)
+
+    def __len__(self):
+        return self._snap._rule_count
+
+
+class Snapshot:
+    def __init__(self, path):
+        self.path = path
+        self._digest = None
+        with open(path, "rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = HEADER.unpack_from(self._buf, 0)[:2]
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not a WAF snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"{path} has snapshot version {version}, expected {VERSION}")
+        _, _, section_count, self.source_mtime_ns, self.source_size, self.catalog_stamp = HEADER.unpack_from(self._buf, 0)
+
+        self._sections = {}
+        for i in range(section_count):
+            tag, offset, length = SECTION.unpack_from(self._buf, HEADER.size + SECTION.size * i)
+            self._sections[tag] = (offset, length)
+
+        strs = self._sections[b"STRS"][0]
+        self._str_count = U32.unpack_from(self._buf, strs)[0]
+        self._str_offsets = strs + U32.size
+        self._str_data = self._str_offsets + U32.size * (self._str_count + 1)
+
+        self._rule_base = self._sections[b"RULE"][0]
+        self._rule_count = U32.unpack_from(self._buf, self._rule_base)[0]
+        self._rule_idx = self._sections[b"RIDX"][0]
+        self._blob = self._sections[b"BLOB"][0]
+
+        self.rules = _RuleTable(self)
+        self.producers = _Adjacency(self, b"PROD")
+        self.consumers = _Adjacency(self, b"CONS")
+
+    def close(self):
+        self._buf.close()
+
+    @property
+    def digest(self):
+        # Content hash of the whole snapshot: changes with the ACL, the catalog and inlined rule groups
+        if self._digest is None:
+            self._digest = hashlib.sha1(self._buf).hexdigest()
+        return self._digest
+
+    def is_stale(self, source, rule_groups=None):
+        try:
+            st = os.stat(source)
+        except FileNotFoundError:
+            return True
+        if (st.st_mtime_ns, st.st_size) != (self.source_mtime_ns, self.source_size):
+            return True
+        if catalog.stamp() != self.catalog_stamp:
+            return True
+        # A referenced rule group was fetched (or changed) after this snapshot was built
+        rule_groups = rule_groups or {}
+        current = {
+            arn: rule_groups[arn].get("LockToken")
+            for arn in self.references_of_kind("rulegroup")
+            if arn in rule_groups
+        }
+        return current != self.meta().get("InlinedRuleGroups", {})
+
+    def _str(self, sid):
+        start, end = struct.unpack_from("<II", self._buf, self._str_offsets + U32.size * sid)
+        return self._buf[self._str_data + start:self._str_data + end].decode("utf-8")
+
+    def _rule_entry(self, i):
+        return RULE_ENTRY.unpack_from(self._buf, self._rule_base + U32.size + RULE_ENTRY.size * i)
+
+    def _rule_name(self, i):
+        return self._str(self._rule_entry(i)[0])
+
+    def _rule(self, i):
+        _, _, _, off, length = self._rule_entry(i)
+        start = self._blob + off
+        return json.loads(self._buf[start:start + length])
+
+    def _find_rule(self, name):
+        lo, hi = 0, self._rule_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = U32.unpack_from(self._buf, self._rule_idx + U32.size * mid)[0]
+            key = self._rule_name(i)
+            if key == name:
+                return i
+            if key < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def rule_summaries(self):
+        # Name, priority and action without decoding the rule bodies
+        for i in range(self._rule_count):
+            name, priority, action, _, _ = self._rule_entry(i)
+            yield {"Name": self._str(name), "Priority": priority, "Action": self._str(action)}
+
+    def priorities(self):
+        return {s["Name"]: s["Priority"] for s in self.rule_summaries()}
+
+    def rule_list(self):
+        return [self._rule(i) for i in range(self._rule_count)]
+
+    def references(self):
+        base, _ = self._sections[b"REFS"]
+        count = U32.unpack_from(self._buf, base)[0]
+        indices = base + U32.size + REF_ENTRY.size * count
+        refs = {}
+        for i in range(count):
+            arn, kind, start, n = REF_ENTRY.unpack_from(self._buf, base + U32.size + REF_ENTRY.size * i)
+            idx = struct.unpack_from(f"<{n}I", self._buf, indices + U32.size * start)
+            refs[self._str(arn)] = {"kind": self._str(kind), "rules": [self._rule_name(j) for j in idx]}
+        return refs
+
+    def references_of_kind(self, kind):
+        return [arn for arn, ref in self.references().items() if ref["kind"] == kind]
+
+    def meta(self):
+        base, length = self._sections[b"META"]
+        return json.loads(self._buf[base:base + length])
+
+
+if __name__ == "__main__":
+    # Usage: python snapshot.py [uploads_dir]
+    upload_dir = sys.argv[1] if len(sys.argv) > 1 else "uploads"
+    snapshot_dir = os.path.join(upload_dir, "snapshots")
+    for root, dirs, names in os.walk(upload_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != snapshot_dir]
+        rule_groups = load_rule_groups(root)
+        for name in sorted(names):
+            if name.endswith(".json") and not name.startswith(NON_ACL_PREFIXES):
+                file_id = os.path.relpath(os.path.join(root, name), upload_dir)
+                dest = ingest(os.path.join(root, name), snapshot_path(snapshot_dir, file_id), rule_groups)
+                print(f"{file_id} -> {dest}")
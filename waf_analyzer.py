@@ -1,33 +1,100 @@
-AWS_MANAGED_RULE_WCU = {
-    "AWSManagedRulesAdminProtectionRuleSet": 100,
-    "AWSManagedRulesAmazonIpReputationList": 25,
-    "AWSManagedRulesAnonymousIpList": 50,
-    "AWSManagedRulesCommonRuleSet": 700,
-    "AWSManagedRulesKnownBadInputsRuleSet": 200,
-    "AWSManagedRulesLinuxRuleSet": 200,
-    "AWSManagedRulesPHPRuleSet": 100,
-    "AWSManagedRulesPOSIXRuleSet": 100,
-    "AWSManagedRulesSQLiRuleSet": 200,
-    "AWSManagedRulesWindowsRuleSet": 200,
-    "AWSManagedRulesWordPressRuleSet": 100
-}
+import hashlib
+import json
+import threading
+from collections import OrderedDict
 
-def calculate_wcu_static(data):
+import yaml
+
+import catalog
+import iac_ingest
+
+# WCU charged for a managed rule group the catalog doesn't know
+DEFAULT_MANAGED_WCU = 100
+
+# libyaml's loader (when available) with CloudFormation's !Ref / !GetAtt / ... tags
+YAML_LOADER = iac_ingest.CloudFormationLoader
+
+RULE_CACHE_MAX_ENTRIES = 50000
+_rule_cache = OrderedDict()  # { statement hash: (wcu, detail) }, least recently used first
+_rule_cache_stamp = None
+_rule_cache_lock = threading.Lock()
+
+def parse_document(text, format_selected):
+    if format_selected == "yaml":
+        return yaml.load(text, Loader=YAML_LOADER)
+    if format_selected == "hcl":
+        return iac_ingest.parse_document(text, "tf")
+    return json.loads(text)
+
+def extract_rules(data):
     # Handle both formats
     if isinstance(data, dict) and "Rules" in data:
-        rules = data["Rules"]
+        return data["Rules"]
     elif isinstance(data, list):
-        rules = data
+        return data
     elif isinstance(data, dict) and "Statement" in data:
-        rules = [data]
-    else:
-        raise ValueError("Unsupported input: expected a dict with 'Rules' or a list of rules.")
+        return [data]
+    elif isinstance(data, dict) and ("Resources" in data or "resource" in data):
+        # CloudFormation or Terraform: the rules of every WebACL and rule group it defines
+        rules = [rule for _, resource in iac_ingest.extract_document(data) for rule in resource.get("Rules", [])]
+        if rules:
+            return rules
+    raise ValueError(
+        "Unsupported input: expected a dict with 'Rules', a list of rules, "
+        "or a Terraform / CloudFormation template with WAFv2 resources."
+    )
+
+def statement_key(stmt):
+    return hashlib.sha1(json.dumps(stmt, sort_keys=True, default=str).encode("utf-8")).digest()
+
+def sync_rule_cache():
+    # Managed rule group capacities come from the catalog, so a catalog change drops the cache
+    global _rule_cache_stamp
+    stamp = catalog.stamp()
+    with _rule_cache_lock:
+        if stamp != _rule_cache_stamp:
+            _rule_cache.clear()
+            _rule_cache_stamp = stamp
+
+def analyze_statement_cached(stmt):
+    """analyze_statement, memoized on the statement's structure. Returns (wcu, detail, was_cached)."""
+    key = statement_key(stmt)
+    with _rule_cache_lock:
+        cached = _rule_cache.get(key)
+        if cached is not None:
+            _rule_cache.move_to_end(key)
+            return cached[0], cached[1], True
+
+    wcu, detail = analyze_statement(stmt)
+    with _rule_cache_lock:
+        _rule_cache[key] = (wcu, detail)
+        if len(_rule_cache) > RULE_CACHE_MAX_ENTRIES:
+            _rule_cache.popitem(last=False)
+    return wcu, detail, False
+
+def analyze_rules(rules):
+    """Per-rule WCU as { rule key: {name, wcu, detail} } plus how many rules had to be re-costed."""
+    sync_rule_cache()
+    results = {}
+    recomputed = 0
+    for i, rule in enumerate(rules):
+        name = rule.get("Name", "Unnamed Rule")
+        # Rules are matched across revisions by name; unnamed or duplicate names fall back to position
+        key = name if name not in results and "Name" in rule else f"{name}#{i}"
+        wcu, detail, was_cached = analyze_statement_cached(rule.get("Statement", {}))
+        recomputed += not was_cached
+        results[key] = {"name": name, "wcu": wcu, "detail": detail}
+    return results, recomputed
+
+def calculate_wcu_static(data):
+    rules = extract_rules(data)
+    sync_rule_cache()
 
     total_wcu = 0
     details = []
 
     for rule in rules:
-        wcu, detail = analyze_statement(rule.get("Statement", {}))
+        wcu, detail, _ = analyze_statement_cached(rule.get("Statement", {}))
         rule_name = rule.get("Name", "Unnamed Rule")
         details.append(f"{rule_name} → {wcu} WCU ({detail})")
         total_wcu += wcu
@@ -126,7 +193,8 @@ def analyze_statement(stmt):
     if "ManagedRuleGroupStatement" in stmt:
         group = stmt["ManagedRuleGroupStatement"].get("Name", "")
         vendor = stmt["ManagedRuleGroupStatement"].get("VendorName", "")
-        wcu = AWS_MANAGED_RULE_WCU.get(group, 100)  # fallback default
+        version = stmt["ManagedRuleGroupStatement"].get("Version")
+        wcu = catalog.capacity(vendor, group, version) or DEFAULT_MANAGED_WCU
         return wcu, f"ManagedRuleGroupStatement ({vendor}/{group}) → {wcu} WCU"
 
     # Logical: And / Or